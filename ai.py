@@ -1,183 +1,893 @@
+from multiprocessing import Pool
 from random import randint, sample
+from time import time
+
+import engine
+from book import open_book
+from tablebase import open_tablebases
+
+
+# what a stored score says about the true score of its position
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
 
 
 class AI:
     checkmate = 1000 #float('inf')
     stalemate = 0
 
-    max_depth = 3
+    # the deepest iteration searched, the clock decides where it stops
+    # before that, and the depth of the searches that don't deepen
+    max_depth = 20
+    fixed_depth = 3
 
+    # a game is planned as this many moves, and however long it has gone
+    # on at least min_moves_to_go are assumed to be left
+    moves_to_go = 40
+    min_moves_to_go = 20
 
-def add_ai_move(prog, ai_game_state):
-    prog.looking_for_ai_move = True
+    # seconds per move in a game without a clock
+    untimed_move_time = 5.0
 
-    ai_move = find_best_move_nega_max_a_b(ai_game_state, prog.comp)
+    hash_size_mb = 16
 
-    if ai_move is None:
-        ai_move = find_random_move(ai_game_state)
+    # opening book built by book.py, played from before searching, no book
+    # is used if the file isn't there
+    book_path = 'book.bin'
 
-    # manually added the ai_move here as threading means returning this is a
-    # bit awkward
-    prog.add_ai_move(ai_move)
+    # directory of endgame tables made by tablebase.py, used in place of a
+    # search once few enough pieces are left
+    tablebase_path = 'tablebases'
 
-    prog.looking_for_ai_move = False
+    # processes the root moves are shared out between, one searches in this
+    # process
+    workers = 1
 
+    # captures that leave the side this far short of alpha, even winning the
+    # piece outright, aren't searched at the horizon, and a horizon search
+    # stops looking at captures after this many positions
+    delta_margin = 2
+    max_quiescence_nodes = 2000
 
-def find_best_move_nega_max_a_b(game_state, comp):
-    global next_move
 
-    next_move = None
+class TranspositionTable:
+    # rough size of one entry tuple plus its slot in the list, used to turn
+    # the memory cap into a number of entries
+    entry_size = 120
 
-    find_move_nega_max_a_b(game_state, game_state.valid_moves, comp,
-                           comp.max_depth, -1 * comp.checkmate, comp.checkmate,
-                           1 if game_state.white_move else -1)
+    def __init__(self, size_mb):
+        self.buckets = max(1, size_mb * 2**20 // (2 * self.entry_size))
+        self.clear()
 
-    return next_move
+    def clear(self):
+        # two slots per bucket, the first keeps the deepest result and the
+        # second is always replaced
+        self.entries = [None] * (2 * self.buckets)
+        self.generation = 0
 
+    def new_search(self):
+        self.generation += 1
 
-def find_move_nega_max_a_b(game_state, valid_moves, comp, current_depth,
-                           alpha, beta, turn_multiplier):
-    global next_move
+    def probe(self, key):
+        i = 2 * (key % self.buckets)
 
-    if current_depth == 0:
-        return turn_multiplier * score_board(game_state, comp)
+        entry = self.entries[i]
+        if entry is not None and entry[0] == key:
+            return entry
 
-    # can add move ordering later to improve efficiency
+        entry = self.entries[i + 1]
+        if entry is not None and entry[0] == key:
+            return entry
 
-    shuffled_moves = sample(valid_moves, len(valid_moves))
+        return None
 
-    max_score = -1 * comp.checkmate
+    def store(self, key, depth, score, bound, move_id):
+        i = 2 * (key % self.buckets)
+        entry = (key, depth, score, bound, move_id, self.generation)
 
-    for move in shuffled_moves:
-        game_state.make_move(move, quick=True)
+        # the deep slot is only given up to a search at least as deep, or
+        # once what it holds is left over from an earlier move
+        old_entry = self.entries[i]
+        if old_entry is None or old_entry[0] == key or \
+                depth >= old_entry[1] or old_entry[5] != self.generation:
+            self.entries[i] = entry
+        else:
+            self.entries[i + 1] = entry
 
-        #next_moves = game_state.get_valid_moves(return_moves=True)
 
-        score = -1 * find_move_nega_max_a_b(game_state,
-                                            game_state.valid_moves, comp,
-                                            current_depth - 1,
-                                            -beta, -alpha,
-                                            -1 * turn_multiplier)
+class SearchStats:
+    def __init__(self, on_iteration=None):
+        # called with the stats after every completed iteration
+        self.on_iteration = on_iteration
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.hash_probes = 0
+        self.hash_hits = 0
+
+        self.depth = 0
+        self.score = 0
+        self.principal_variation = []
+
+        self.start_time = time()
+        self.time_taken = 0.0
+
+    def merge(self, other):
+        self.nodes += other.nodes
+        self.quiescence_nodes += other.quiescence_nodes
+        self.cutoffs += other.cutoffs
+        self.first_move_cutoffs += other.first_move_cutoffs
+        self.hash_probes += other.hash_probes
+        self.hash_hits += other.hash_hits
+
+    def end_iteration(self, depth, score, principal_variation):
+        self.depth = depth
+        self.score = score
+        self.principal_variation = principal_variation
+        self.time_taken = time() - self.start_time
+
+        if self.on_iteration is not None:
+            self.on_iteration(self)
+
+    def get_nodes_per_second(self):
+        time_taken = self.time_taken or time() - self.start_time
+
+        return (self.nodes + self.quiescence_nodes) / max(time_taken, 1e-9)
 
-        if score > max_score:
-            max_score = score
-            if current_depth == comp.max_depth:
-                next_move = move
+    def get_first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
 
-        game_state.undo_move(quick=True)
+    def get_hash_hit_rate(self):
+        return self.hash_hits / self.hash_probes if self.hash_probes else 0.0
+
+    def __str__(self):
+        return 'depth {} score {:.2f} nodes {} qnodes {} nps {:.0f} ' \
+               'first cut-offs {:.0%} hash hits {:.0%} pv {}'.format(
+                   self.depth, self.score, self.nodes, self.quiescence_nodes,
+                   self.get_nodes_per_second(),
+                   self.get_first_move_cutoff_rate(),
+                   self.get_hash_hit_rate(),
+                   ' '.join(self.principal_variation))
 
-        if max_score > alpha:
-            alpha = max_score
 
-        if alpha >= beta:
-            break
+class Searcher:
+    # everything a search changes lives here rather than in module globals,
+    # so any number of searches can run at once from different threads as
+    # long as each has its own searcher and its own copy of the game state
+    def __init__(self, comp=None):
+        self.comp = AI() if comp is None else comp
 
-    return max_score
+        self.next_move = None
 
+        # kept for the whole game so each search starts from the positions
+        # the previous ones already searched
+        self.transposition_table = TranspositionTable(self.comp.hash_size_mb)
 
+        self.search_depth = self.comp.max_depth
+        self.deadline = float('inf')
+        self.stopped = False
 
+        # two quiet moves per ply that last caused a cut-off there, and how
+        # much each quiet move, by its start and end squares, has cut off
+        self.killers = [[None, None] for _ in range(self.comp.max_depth + 1)]
+        self.history = {}
 
-def find_best_move_nega_max(game_state, comp):
-    global next_move
+        self.quiescence_nodes = 0
 
-    next_move = None
+        # set to a SearchStats to have the searches fill it in, left as None
+        # they skip the counting
+        self.stats = None
 
-    find_move_nega_max(game_state, game_state.valid_moves, comp,
-                       comp.max_depth,
-                       1 if game_state.white_move else -1)
+        # started on the first parallel search and kept for the rest of the
+        # game so each worker keeps its own transposition table
+        self.pool = None
 
-    return next_move
+        self.book = open_book(self.comp.book_path) \
+            if self.comp.book_path else None
 
+        # mapped, so worker processes opening them share the same pages
+        self.tablebases = open_tablebases(self.comp.tablebase_path) \
+            if self.comp.tablebase_path else None
 
-def find_move_nega_max(game_state, valid_moves, comp, current_depth,
-                       turn_multiplier):
-    global next_move
+    def close(self):
+        # the worker processes are only started again by another parallel
+        # search
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
 
-    if current_depth == 0:
-        return turn_multiplier * score_board(game_state, comp)
+    def find_best_move(self, game_state):
+        if self.comp.workers > 1:
+            return self.find_best_move_parallel(game_state)
 
-    shuffled_moves = sample(valid_moves, len(valid_moves))
+        return self.find_best_move_nega_max_a_b(game_state)
 
-    max_score = -1 * comp.checkmate
+    def search_moves(self, game_state, moves, depth, alpha):
+        # the score of each root move that comes out above alpha, which is
+        # raised as better moves are found, or None if time ran out
+        comp = self.comp
+        turn_multiplier = 1 if game_state.white_move else -1
+        results = []
 
-    for move in shuffled_moves:
-        game_state.make_move(move, quick=True)
+        for move in moves:
+            game_state.make_move(move, quick=True)
 
-        #next_moves = game_state.get_valid_moves(return_moves=True)
+            score = -1 * self.find_move_nega_max_a_b(game_state, None,
+                                                     depth - 1,
+                                                     -1 * comp.checkmate,
+                                                     -alpha,
+                                                     -1 * turn_multiplier)
 
-        score = -1 * find_move_nega_max(game_state, game_state.valid_moves,
-                                        comp, current_depth - 1,
-                                        -1 * turn_multiplier)
+            game_state.undo_move(quick=True)
 
-        if score > max_score:
-            max_score = score
-            if current_depth == comp.max_depth:
-                next_move = move
+            if self.stopped:
+                return None
 
-        game_state.undo_move()
+            if score > alpha:
+                alpha = score
+                results.append((move.move_id, score))
 
-    return max_score
+        return results
 
+    def find_best_move_parallel(self, game_state):
+        comp = self.comp
 
+        best_move = self.get_tablebase_move(game_state)
+        if best_move is not None:
+            return best_move
 
+        if self.pool is None:
+            self.pool = Pool(comp.workers, initializer=init_worker,
+                             initargs=(comp,))
 
-def find_best_move_min_max(game_state, comp):
-    global next_move
+        position = get_position(game_state)
+        moves = {move.move_id: move for move in game_state.valid_moves}
 
-    next_move = None
+        start_time = time()
+        move_time = get_move_time(game_state, comp)
 
-    find_move_min_max(game_state, game_state.valid_moves, comp,
-                      comp.max_depth, game_state.white_move)
+        self.deadline = start_time + move_time
+        self.transposition_table.new_search()
+        self.killers = [[None, None] for _ in range(comp.max_depth + 1)]
 
-    return next_move
+        if self.stats is not None:
+            self.stats.reset()
 
+        root_moves = sample(game_state.valid_moves,
+                            len(game_state.valid_moves))
+        best_move = None
+
+        for depth in range(1, comp.max_depth + 1):
+            self.search_depth = depth
+            self.stopped = False
+
+            move_key = self.get_move_key(game_state, 0)
+            root_moves.sort(key=lambda move: (move is best_move,
+                                              move_key(move)),
+                            reverse=True)
+
+            # the likeliest best move is searched here first, giving the
+            # rest a score to beat so that the workers can cut off as a
+            # single search would, and the rest are dealt out in order so
+            # that each worker starts on a likely good one, the first is
+            # searched below any score so that it is kept even if it loses
+            results = self.search_moves(game_state, root_moves[:1], depth,
+                                        -1 * comp.checkmate - 1)
+            if not results:
+                break
+
+            alpha = results[0][1]
+            principal_variations = {}
+            shares = [[move.move_id
+                       for move in root_moves[1 + i::comp.workers]]
+                      for i in range(comp.workers)]
+
+            for worker_results, worker_stats, principal_variation in \
+                    self.pool.starmap(
+                        search_root_moves,
+                        [(position, move_ids, depth, alpha, self.deadline,
+                          self.stats is not None)
+                         for move_ids in shares if move_ids]):
+                if worker_stats is not None:
+                    self.stats.merge(worker_stats)
+                if worker_results is None:
+                    self.stopped = True
+                else:
+                    results += worker_results
+                    if principal_variation is not None:
+                        principal_variations[worker_results[-1][0]] = \
+                            principal_variation
+
+            if self.stopped:
+                break
+
+            move_id, score = max(results, key=lambda result: result[1])
+            best_move = moves[move_id]
+
+            if self.stats is not None:
+                # a move a worker found best has its line from the worker
+                if move_id not in principal_variations:
+                    principal_variations[move_id] = \
+                        self.get_principal_variation(game_state, depth,
+                                                     move_id)
+                self.stats.end_iteration(depth, score,
+                                         principal_variations[move_id])
+
+            if abs(score) == comp.checkmate or \
+                    time() - start_time > move_time / 2:
+                break
+
+        self.deadline = float('inf')
+
+        return best_move
+
+    def get_tablebase_move(self, game_state):
+        # the move to the best position in the tables, or None unless every
+        # move leads to one
+        if self.tablebases is None or \
+                len(game_state.white_has) + len(game_state.black_has) > \
+                self.tablebases.max_pieces:
+            return None
+
+        best_move = None
+        max_score = -1 * self.comp.checkmate - 1
+
+        for move in game_state.valid_moves:
+            game_state.make_move(move, quick=True)
+            result = self.tablebases.probe(game_state)
+            game_state.undo_move(quick=True)
+
+            if result is None:
+                return None
+
+            score = -1 * get_tablebase_score(result, self.comp)
+            if score > max_score:
+                max_score = score
+                best_move = move
 
-def find_move_min_max(game_state, valid_moves, comp, current_depth,
-                      white_move):
-    global next_move
+        return best_move
+
+    def find_best_move_nega_max_a_b(self, game_state):
+        comp = self.comp
+
+        best_move = self.get_tablebase_move(game_state)
+        if best_move is not None:
+            return best_move
+
+        start_time = time()
+        move_time = get_move_time(game_state, comp)
+
+        self.deadline = start_time + move_time
+        self.stopped = False
+
+        self.transposition_table.new_search()
+
+        # killers are only good for the position they were found in,
+        # history is kept but counts for less than what this search finds
+        self.killers = [[None, None] for _ in range(comp.max_depth + 1)]
+        for move_id in self.history:
+            self.history[move_id] //= 2
+
+        if self.stats is not None:
+            self.stats.reset()
+
+        best_move = None
+
+        # each iteration leaves its best moves in the table to be searched
+        # first by the next, and only a completed iteration's move is ever
+        # played
+        for depth in range(1, comp.max_depth + 1):
+            self.next_move = None
+            self.search_depth = depth
+
+            score = self.find_move_nega_max_a_b(
+                game_state, game_state.valid_moves, depth,
+                -1 * comp.checkmate, comp.checkmate,
+                1 if game_state.white_move else -1)
+
+            if self.stopped:
+                break
+
+            best_move = self.next_move
+
+            if self.stats is not None and best_move is not None:
+                self.stats.end_iteration(depth, score,
+                                         self.get_principal_variation(
+                                             game_state, depth,
+                                             best_move.move_id))
+
+            # a forced mate won't change with depth, and the next iteration
+            # takes several times as long as this one so it wouldn't finish
+            if abs(score) == comp.checkmate or \
+                    time() - start_time > move_time / 2:
+                break
+
+        self.deadline = float('inf')
+
+        return best_move
+
+    def find_move_nega_max_a_b(self, game_state, valid_moves, current_depth,
+                               alpha, beta, turn_multiplier):
+        comp = self.comp
+
+        # the first iteration always finishes so there is a move to play
+        if self.stopped or \
+                (self.search_depth > 1 and time() > self.deadline):
+            self.stopped = True
+            return 0
+
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+
+        # a position already seen is scored as a draw, as repeating it again
+        # is always available to the side that would otherwise lose
+        if current_depth != self.search_depth and \
+                game_state.count_repetitions():
+            return comp.stalemate
+
+        # the tables know the result, and a quicker mate scores higher
+        if current_depth != self.search_depth and \
+                self.tablebases is not None and \
+                len(game_state.white_has) + len(game_state.black_has) <= \
+                self.tablebases.max_pieces:
+            result = self.tablebases.probe(game_state)
+            if result is not None:
+                return get_tablebase_score(result, comp)
+
+        # rather than score a position in the middle of an exchange, play
+        # out the captures first
+        if current_depth == 0:
+            self.quiescence_nodes = 0
+            return self.find_move_quiescence(game_state, alpha, beta,
+                                             turn_multiplier)
+
+        hash_move_id = None
+
+        entry = self.transposition_table.probe(game_state.hash_key)
+        if stats is not None:
+            stats.hash_probes += 1
+            stats.hash_hits += entry is not None
+        if entry is not None:
+            hash_move_id = entry[4]
+
+            # the root always searches so that it has a move to play
+            if entry[1] >= current_depth and \
+                    current_depth != self.search_depth:
+                if entry[3] == EXACT:
+                    return entry[2]
+                elif entry[3] == LOWER_BOUND:
+                    alpha = max(alpha, entry[2])
+                else:
+                    beta = min(beta, entry[2])
 
-    if current_depth == 0:
-        return score_material(game_state.board, game_state.piece_scores)
+                if alpha >= beta:
+                    return entry[2]
 
-    shuffled_moves = sample(valid_moves, len(valid_moves))
+        alpha_original = alpha
 
-    if white_move:
-        max_score = -comp.checkmate
+        ply = self.search_depth - current_depth
+        move_key = self.get_move_key(game_state, ply)
+
+        # only the root is given its moves, below it they are generated
+        # lazily so the stages after a cut-off are never generated, with the
+        # stored best move tried first, at the root the shuffle only breaks
+        # ties
+        if valid_moves is None:
+            shuffled_moves = game_state.get_staged_moves(hash_move_id,
+                                                         move_key)
+        else:
+            shuffled_moves = sample(valid_moves, len(valid_moves))
+            shuffled_moves.sort(key=lambda move: (
+                move.move_id == hash_move_id, move_key(move)), reverse=True)
+
+        max_score = -1 * comp.checkmate
+        best_move_id = None
+        moves_searched = 0
 
         for move in shuffled_moves:
-            game_state.make_move(move)
-            next_moves = game_state.get_valid_moves(return_moves=True)
-            score = find_move_min_max(game_state, next_moves, comp,
-                                      current_depth - 1, white_move=False)
+            moves_searched += 1
+
+            game_state.make_move(move, quick=True)
+
+            #next_moves = game_state.get_valid_moves(return_moves=True)
+
+            score = -1 * self.find_move_nega_max_a_b(game_state, None,
+                                                     current_depth - 1,
+                                                     -beta, -alpha,
+                                                     -1 * turn_multiplier)
+
+            game_state.undo_move(quick=True)
+
+            # a search cut short is worth nothing, so it isn't stored either
+            if self.stopped:
+                return 0
 
             if score > max_score:
                 max_score = score
-                if current_depth == comp.max_depth:
-                    next_move = move
+                best_move_id = move.move_id
+                if current_depth == self.search_depth:
+                    self.next_move = move
+
+            if max_score > alpha:
+                alpha = max_score
+
+            if alpha >= beta:
+                if move.piece_captured[1] == '-' and \
+                        not move.is_pawn_promotion:
+                    self.add_killer_move(ply, move, current_depth)
+                if stats is not None:
+                    stats.cutoffs += 1
+                    stats.first_move_cutoffs += moves_searched == 1
+                break
+
+        if not moves_searched and not game_state.in_check:
+            max_score = comp.stalemate
+
+        if max_score <= alpha_original:
+            bound = UPPER_BOUND
+        elif max_score >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
 
-            game_state.undo_move()
+        self.transposition_table.store(game_state.hash_key, current_depth,
+                                       max_score, bound, best_move_id)
 
         return max_score
 
-    else:
-        min_score = comp.checkmate
+    def find_move_quiescence(self, game_state, alpha, beta, turn_multiplier):
+        comp = self.comp
+
+        self.quiescence_nodes += 1
+        if self.stats is not None:
+            self.stats.quiescence_nodes += 1
+
+        if self.stopped or \
+                (self.search_depth > 1 and time() > self.deadline):
+            self.stopped = True
+            return 0
+
+        # past the limit the position is scored as it stands, in check or not
+        if self.quiescence_nodes > comp.max_quiescence_nodes:
+            return turn_multiplier * score_board(game_state, comp)
+
+        # only captures, or every evasion when in check
+        moves = game_state.get_capture_moves()
+        in_check = game_state.in_check
+
+        if in_check:
+            if not moves:
+                return -1 * comp.checkmate
+            stand_pat = max_score = -1 * comp.checkmate
+        else:
+            # the side to move can always decline to capture
+            stand_pat = max_score = turn_multiplier * \
+                score_board(game_state, comp)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+
+        piece_scores = game_state.piece_scores
+        moves.sort(key=lambda move: 10 * piece_scores[
+            move.piece_captured[1]] - piece_scores[move.piece_moved[1]],
+                   reverse=True)
+
+        for move in moves:
+            if not in_check:
+                gain = piece_scores[move.piece_captured[1]]
+                if move.is_pawn_promotion:
+                    gain += piece_scores[move.promotion] - piece_scores['p']
+                if stand_pat + gain + comp.delta_margin <= alpha:
+                    continue
+
+            game_state.make_move(move, quick=True)
+
+            score = -1 * self.find_move_quiescence(game_state, -beta, -alpha,
+                                                   -1 * turn_multiplier)
+
+            game_state.undo_move(quick=True)
+
+            if score > max_score:
+                max_score = score
+
+            if max_score > alpha:
+                alpha = max_score
+
+            if alpha >= beta:
+                break
+
+        return max_score
+
+    def get_principal_variation(self, game_state, depth, move_id):
+        # the best move at the root, then the best moves stored in the table
+        # from there on, stopping at a move that isn't legal in case of a
+        # clash of hash keys
+        principal_variation = []
+
+        while move_id is not None and len(principal_variation) < depth:
+            move = next(game_state.get_staged_moves(move_id), None)
+            if move is None or move.move_id != move_id:
+                break
+
+            game_state.make_move(move, quick=True)
+            principal_variation.append(move.get_simple_notation())
+
+            entry = self.transposition_table.probe(game_state.hash_key)
+            move_id = None if entry is None else entry[4]
+
+        for _ in principal_variation:
+            game_state.undo_move(quick=True)
+
+        return principal_variation
+
+    def get_move_key(self, game_state, ply):
+        piece_scores = game_state.piece_scores
+        killers = self.killers[ply]
+        history = self.history
+
+        # captures and promotions first, most valuable victim then least
+        # valuable attacker, then the killers, then quiet moves by history
+        def move_key(move):
+            gain = piece_scores[move.piece_captured[1]]
+            if move.is_pawn_promotion:
+                gain += piece_scores[move.promotion]
+            if gain:
+                return 2, 10 * gain - piece_scores[move.piece_moved[1]]
+
+            if move.move_id in killers:
+                return 1, -killers.index(move.move_id)
+
+            return 0, history.get(move.move_id & 4095, 0)
+
+        return move_key
+
+    def add_killer_move(self, ply, move, depth):
+        killers = self.killers[ply]
+        if killers[0] != move.move_id:
+            killers[1] = killers[0]
+            killers[0] = move.move_id
+
+        # deeper cut-offs save more work so count for more
+        move_id = move.move_id & 4095
+        self.history[move_id] = self.history.get(move_id, 0) + depth * depth
+
+    def find_best_move_nega_max(self, game_state):
+        comp = self.comp
+
+        self.next_move = None
+
+        if self.stats is not None:
+            self.stats.reset()
+
+        score = self.find_move_nega_max(game_state, game_state.valid_moves,
+                                        comp.fixed_depth,
+                                        1 if game_state.white_move else -1)
+
+        if self.stats is not None:
+            self.stats.end_iteration(comp.fixed_depth, score, [])
+
+        return self.next_move
+
+    def find_move_nega_max(self, game_state, valid_moves, current_depth,
+                           turn_multiplier):
+        comp = self.comp
+
+        if self.stats is not None:
+            self.stats.nodes += 1
+
+        if current_depth != comp.fixed_depth and \
+                game_state.count_repetitions():
+            return comp.stalemate
+
+        if current_depth == 0:
+            if not game_state.has_legal_moves():
+                return -1 * comp.checkmate if game_state.in_check else \
+                    comp.stalemate
+            return turn_multiplier * score_board(game_state, comp)
+
+        if valid_moves is None:
+            shuffled_moves = game_state.get_staged_moves()
+        else:
+            shuffled_moves = sample(valid_moves, len(valid_moves))
+
+        max_score = -1 * comp.checkmate
+        any_moves = False
 
         for move in shuffled_moves:
-            game_state.make_move(move)
-            next_moves = game_state.get_valid_moves(return_moves=True)
-            score = find_move_min_max(game_state, next_moves, comp,
-                                      current_depth - 1, white_move=True)
+            any_moves = True
+
+            game_state.make_move(move, quick=True)
+
+            #next_moves = game_state.get_valid_moves(return_moves=True)
+
+            score = -1 * self.find_move_nega_max(game_state, None,
+                                                 current_depth - 1,
+                                                 -1 * turn_multiplier)
 
-            if score < min_score:
-                min_score = score
-                if current_depth == comp.max_depth:
-                    next_move = move
+            if score > max_score:
+                max_score = score
+                if current_depth == comp.fixed_depth:
+                    self.next_move = move
+
+            game_state.undo_move(quick=True)
+
+        if not any_moves and not game_state.in_check:
+            return comp.stalemate
+
+        return max_score
+
+    def find_best_move_min_max(self, game_state):
+        comp = self.comp
+
+        self.next_move = None
+
+        if self.stats is not None:
+            self.stats.reset()
 
-            game_state.undo_move()
+        score = self.find_move_min_max(game_state, game_state.valid_moves,
+                                       comp.fixed_depth,
+                                       game_state.white_move)
 
-        return min_score
+        if self.stats is not None:
+            self.stats.end_iteration(comp.fixed_depth, score, [])
 
+        return self.next_move
+
+    def find_move_min_max(self, game_state, valid_moves, current_depth,
+                          white_move):
+        comp = self.comp
+
+        if self.stats is not None:
+            self.stats.nodes += 1
+
+        if current_depth == 0:
+            return score_material(game_state.squares, game_state.piece_scores)
+
+        shuffled_moves = sample(valid_moves, len(valid_moves))
+
+        if white_move:
+            max_score = -comp.checkmate
+
+            for move in shuffled_moves:
+                game_state.make_move(move)
+                next_moves = game_state.get_valid_moves(return_moves=True)
+                score = self.find_move_min_max(game_state, next_moves,
+                                               current_depth - 1,
+                                               white_move=False)
+
+                if score > max_score:
+                    max_score = score
+                    if current_depth == comp.fixed_depth:
+                        self.next_move = move
+
+                game_state.undo_move()
+
+            return max_score
+
+        else:
+            min_score = comp.checkmate
+
+            for move in shuffled_moves:
+                game_state.make_move(move)
+                next_moves = game_state.get_valid_moves(return_moves=True)
+                score = self.find_move_min_max(game_state, next_moves,
+                                               current_depth - 1,
+                                               white_move=True)
+
+                if score < min_score:
+                    min_score = score
+                    if current_depth == comp.fixed_depth:
+                        self.next_move = move
+
+                game_state.undo_move()
+
+            return min_score
+
+
+def add_ai_move(prog, ai_game_state):
+    prog.looking_for_ai_move = True
+
+    ai_move = None
+    if prog.searcher.book is not None:
+        ai_move = prog.searcher.book.get_move(ai_game_state)
+
+    if ai_move is None:
+        ai_move = prog.searcher.find_best_move(ai_game_state)
+
+    if ai_move is None:
+        ai_move = find_random_move(ai_game_state)
+
+    # manually added the ai_move here as threading means returning this is a
+    # bit awkward
+    prog.add_ai_move(ai_move)
+
+    prog.looking_for_ai_move = False
+
+
+def get_move_time(game_state, comp):
+    if not game_state.timed_game:
+        return comp.untimed_move_time
+
+    time_left = game_state.white_time if game_state.white_move else \
+        game_state.black_time
+
+    moves_played = len(game_state.move_log) // 2
+    moves_to_go = max(comp.moves_to_go - moves_played, comp.min_moves_to_go)
+
+    return time_left / moves_to_go
+
+
+def get_position(game_state):
+    # all a worker needs to search the position, the hash keys are the ones
+    # since the last capture or pawn move, which repetitions are looked for in
+    halfmoves = min(game_state.moves_since_pawn_move,
+                    game_state.moves_since_capture)
+
+    return game_state.get_fen(), game_state.hash_log[-halfmoves - 1:]
+
+
+def load_position(position):
+    fen, hash_log = position
+
+    game_state = engine.GameState(game_type='standard', fen=fen)
+    game_state.hash_log = list(hash_log)
+
+    return game_state
+
+
+def init_worker(comp):
+    # a worker process only ever runs one search at a time
+    global worker_searcher
+
+    worker_searcher = Searcher(comp)
+    worker_searcher.book = None
+
+
+def search_root_moves(position, move_ids, depth, alpha, deadline,
+                      collect_stats):
+    game_state = load_position(position)
+    moves = [move for move in game_state.valid_moves
+             if move.move_id in move_ids]
+
+    # each search starts with a first iteration
+    if depth == 1:
+        worker_searcher.transposition_table.new_search()
+    if len(worker_searcher.killers) <= depth:
+        worker_searcher.killers = [[None, None] for _ in range(depth + 1)]
+
+    worker_searcher.search_depth = depth
+    worker_searcher.deadline = deadline
+    worker_searcher.stopped = False
+    worker_searcher.stats = SearchStats() if collect_stats else None
+
+    results = worker_searcher.search_moves(game_state, moves, depth, alpha)
+
+    # the line after the worker's best move is in the worker's own table,
+    # so it is read here and sent back for the stats
+    principal_variation = None
+    if collect_stats and results:
+        principal_variation = worker_searcher.get_principal_variation(
+            game_state, depth, results[-1][0])
+
+    return results, worker_searcher.stats, principal_variation
+
+
+
+
+def get_tablebase_score(result, comp):
+    outcome, plies = result
+    if not outcome:
+        return comp.stalemate
 
+    return outcome * (comp.checkmate - plies)
 
 
 def find_best_move_basic(game_state, comp):
@@ -215,7 +925,7 @@ def find_best_move_basic(game_state, comp):
                     score = comp.stalemate
                 else:
                     score = -turn_multiplier * \
-                            score_material(game_state.board,
+                            score_material(game_state.squares,
                                            game_state.piece_scores)
 
                 if score > opponent_max_score:
@@ -246,16 +956,16 @@ def score_board(game_state, comp):
     elif game_state.stalemate:
         return comp.stalemate
 
-    score = score_material(game_state.board, game_state.piece_scores)
+    score = game_state.material['w'] - game_state.material['b'] + \
+        game_state.get_positional_score()
 
     return score
 
 
-def score_material(board, piece_scores):
+def score_material(squares, piece_scores):
     score = 0
 
-    for row in board:
-        for square in row:
-            score += piece_scores[square[1]] * (+1 if square[0] == 'w' else -1)
+    for square in squares:
+        score += piece_scores[square[1]] * (+1 if square[0] == 'w' else -1)
 
     return score
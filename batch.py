@@ -0,0 +1,217 @@
+import numpy as np
+
+import engine
+
+
+# a position is a row of 64 of engine's piece codes in square order, so a8
+# first and h1 last
+PIECE_CODES = engine.PIECE_CODES
+CODES_TO_PIECES = engine.CODES_TO_PIECES
+
+COLORS = ('w', 'b')
+
+# the row a colour's pawns move towards, their double push row and the row
+# they promote on
+PAWN_STEPS = {'w': -1, 'b': 1}
+PAWN_DOUBLE_PUSH_ROWS = {'w': 4, 'b': 3}
+PROMOTION_ROWS = {'w': 0, 'b': 7}
+
+
+def encode_positions(game_states):
+    return np.array([[PIECE_CODES[piece] for piece in game_state.squares]
+                     for game_state in game_states], dtype=np.int8)
+
+
+def get_fen(position, white_move=True):
+    # batches hold only the pieces, so castling and en passant are treated
+    # as unavailable
+    return engine.get_board_fen([CODES_TO_PIECES[int(code)]
+                                 for code in position]) + \
+        (' w' if white_move else ' b') + ' - - 0'
+
+
+def get_piece_values(piece_scores):
+    values = np.zeros(len(PIECE_CODES), dtype=np.int16)
+
+    for piece, code in PIECE_CODES.items():
+        if piece != engine.EMPTY:
+            values[code] = piece_scores[piece[1]] * \
+                (+1 if piece[0] == 'w' else -1)
+
+    return values
+
+
+def score_material(positions, piece_scores):
+    # the batch equivalent of ai.score_material, white minus black
+    return get_piece_values(piece_scores)[positions].sum(axis=1)
+
+
+def get_attack_matrix(attacks):
+    # matrix[start, end] is 1 if a piece on start attacks end, so a batch of
+    # piece masks times the matrix gives the number of attackers per square
+    return np.array([[(attacks[start] >> end) & 1 for end in range(64)]
+                     for start in range(64)], dtype=np.int16)
+
+
+def shift(boards, d):
+    # move every square of a batch of 8x8 boards by d, dropping what falls
+    # off the edge
+    shifted = np.zeros_like(boards)
+    row, col = d
+
+    shifted[:, max(row, 0):8 + min(row, 0), max(col, 0):8 + min(col, 0)] = \
+        boards[:, max(-row, 0):8 + min(-row, 0), max(-col, 0):8 + min(-col, 0)]
+
+    return shifted
+
+
+def get_sliding_attacks(sliders, empty, d):
+    # slide every piece at once one square at a time, only carrying on
+    # through empty squares
+    attacks = np.zeros_like(sliders)
+    ray = sliders
+
+    for _ in range(7):
+        ray = shift(ray, d)
+        attacks |= ray
+        ray = ray & empty
+
+    return attacks
+
+
+def get_sliders(boards, color, j):
+    return (boards == PIECE_CODES[color + 'q']) | \
+        (boards == PIECE_CODES[color + ('r' if j < 4 else 'b')])
+
+
+def get_attack_maps(positions):
+    # number of pieces of each colour attacking each square, shape (N, 2, 64)
+    # with white first
+    boards = positions.reshape(-1, 8, 8)
+    empty = boards == 0
+    attack_maps = np.zeros((len(positions), 2, 64), dtype=np.int16)
+
+    for i, color in enumerate(COLORS):
+        for piece, matrix in ((color + 'n', KNIGHT_MATRIX),
+                              (color + 'k', KING_MATRIX),
+                              (color + 'p', PAWN_MATRICES[color])):
+            attack_maps[:, i] += \
+                (positions == PIECE_CODES[piece]).astype(np.int16) @ matrix
+
+        # a square can only be reached by the nearest slider in a direction,
+        # so adding up the directions counts sliders exactly
+        for j, d in enumerate(engine.DIRECTIONS):
+            attack_maps[:, i] += get_sliding_attacks(
+                get_sliders(boards, color, j), empty, d).reshape(-1, 64)
+
+    return attack_maps
+
+
+def count_pawn_moves(boards, color, empty, enemy):
+    pawns = boards == PIECE_CODES[color + 'p']
+    step = PAWN_STEPS[color]
+
+    pushes = shift(pawns, (step, 0)) & empty
+    double_pushes = shift(pushes, (step, 0)) & empty
+    double_pushes[:, np.arange(8) != PAWN_DOUBLE_PUSH_ROWS[color]] = False
+    captures = (shift(pawns, (step, -1)) & enemy).astype(np.int16) + \
+        (shift(pawns, (step, 1)) & enemy)
+
+    ends = pushes + captures
+    # each move onto the last row is four moves, one per promotion piece
+    ends[:, PROMOTION_ROWS[color]] *= len(engine.PROMOTIONS)
+
+    return ends.sum(axis=(1, 2)) + double_pushes.sum(axis=(1, 2))
+
+
+def get_pinned(boards, color, own, empty):
+    # a piece is pinned if it is the first piece from its king along a line
+    # and the next piece past it is an enemy slider moving along that line
+    kings = boards == PIECE_CODES[color + 'k']
+    enemy_color = 'b' if color == 'w' else 'w'
+    pinned = np.zeros(len(boards), dtype=bool)
+
+    for j, d in enumerate(engine.DIRECTIONS):
+        first = get_sliding_attacks(kings, empty, d) & own
+        behind = get_sliding_attacks(kings, empty | first, d) & \
+            get_sliders(boards, enemy_color, j)
+        pinned |= first.any(axis=(1, 2)) & behind.any(axis=(1, 2))
+
+    return pinned
+
+
+def count_quick_moves(positions, attack_maps, color):
+    # legal move counts for positions with the colour to move not in check
+    # and with nothing pinned, where every pseudo legal move is legal apart
+    # from king moves onto attacked squares, and a flag for which positions
+    # that holds for
+    i = COLORS.index(color)
+    enemy_color = COLORS[1 - i]
+
+    boards = positions.reshape(-1, 8, 8)
+    empty = boards == 0
+    own = (positions > 0) & (positions <= 6) if color == 'w' else \
+        positions > 6
+    enemy = ~own & (positions > 0)
+    own_boards = own.reshape(-1, 8, 8)
+
+    kings = positions == PIECE_CODES[color + 'k']
+    enemy_attacks = attack_maps[:, 1 - i]
+
+    in_check = (enemy_attacks * kings).sum(axis=1) > 0
+    quick = ~in_check & ~get_pinned(boards, color, own_boards, empty)
+
+    counts = count_pawn_moves(boards, color, empty,
+                              enemy.reshape(-1, 8, 8))
+
+    knights = (positions == PIECE_CODES[color + 'n']).astype(np.int16)
+    counts += ((knights @ KNIGHT_MATRIX) * ~own).sum(axis=1)
+
+    king_moves = kings.astype(np.int16) @ KING_MATRIX
+    counts += (king_moves * (~own & (enemy_attacks == 0))).sum(axis=1)
+
+    for j, d in enumerate(engine.DIRECTIONS):
+        counts += (get_sliding_attacks(get_sliders(boards, color, j), empty,
+                                       d) & ~own_boards).sum(axis=(1, 2))
+
+    return counts, quick
+
+
+def count_legal_moves(positions, white_move):
+    # the vectorised count covers most positions, the rest are left to the
+    # engine's own move generator
+    attack_maps = get_attack_maps(positions)
+
+    white_counts, white_quick = count_quick_moves(positions, attack_maps, 'w')
+    black_counts, black_quick = count_quick_moves(positions, attack_maps, 'b')
+
+    counts = np.where(white_move, white_counts, black_counts)
+    quick = np.where(white_move, white_quick, black_quick)
+
+    for n in np.flatnonzero(~quick):
+        game_state = engine.GameState(fen=get_fen(positions[n],
+                                                  white_move[n]))
+        counts[n] = len(game_state.valid_moves)
+
+    return counts
+
+
+def evaluate_positions(positions, white_move, piece_scores=None):
+    if piece_scores is None:
+        piece_scores = engine.GameState().piece_scores
+
+    positions = np.asarray(positions, dtype=np.int8)
+    white_move = np.broadcast_to(np.asarray(white_move, dtype=bool),
+                                 len(positions))
+
+    return {'material': score_material(positions, piece_scores),
+            'attack_maps': get_attack_maps(positions),
+            'legal_moves': count_legal_moves(positions, white_move)}
+
+
+KNIGHT_MATRIX = get_attack_matrix(engine.KNIGHT_ATTACKS)
+
+KING_MATRIX = get_attack_matrix(engine.KING_ATTACKS)
+
+PAWN_MATRICES = {color: get_attack_matrix(engine.PAWN_ATTACKS[color])
+                 for color in COLORS}
@@ -0,0 +1,217 @@
+import argparse
+import mmap
+import re
+import struct
+from collections import Counter
+from random import choices
+
+import engine
+
+
+# one record per book move, the position's hash key, the move id and how
+# often the move was played, big endian so that the records sort by key
+# byte for byte
+RECORD = struct.Struct('>QHH')
+
+MAX_WEIGHT = 2**16 - 1
+
+
+class OpeningBook:
+    def __init__(self, path):
+        # the file is mapped rather than read, so opening it costs nothing
+        # and every process using it shares the same pages
+        self.file = open(path, 'rb')
+        self.size = 0
+        self.data = None
+
+        self.file.seek(0, 2)
+        if self.file.tell():
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            self.size = len(self.data) // RECORD.size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    def get_key(self, i):
+        return struct.unpack_from('>Q', self.data, i * RECORD.size)[0]
+
+    def get_entries(self, hash_key):
+        # binary search for the first record of the position
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            if self.get_key(mid) < hash_key:
+                low = mid + 1
+            else:
+                high = mid
+
+        entries = []
+        while low < self.size:
+            key, move_id, weight = RECORD.unpack_from(self.data,
+                                                      low * RECORD.size)
+            if key != hash_key:
+                break
+            entries.append((move_id, weight))
+            low += 1
+
+        return entries
+
+    def get_move(self, game_state):
+        # a move picked at random in proportion to how often it was played,
+        # from those that are legal in case of a clash of hash keys
+        entries = self.get_entries(game_state.hash_key)
+        if not entries:
+            return None
+
+        moves = {move.move_id: move for move in game_state.valid_moves}
+        entries = [(moves[move_id], weight) for move_id, weight in entries
+                   if move_id in moves]
+        if not entries:
+            return None
+
+        return choices([move for move, _ in entries],
+                       [weight for _, weight in entries])[0]
+
+
+def open_book(path):
+    try:
+        return OpeningBook(path)
+    except OSError:
+        return None
+
+
+def get_san_move(moves, san):
+    # the move of moves written as san, or None if there isn't exactly one
+    san = san.rstrip('+#!?')
+
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        col = 6 if len(san) == 3 else 2
+        for move in moves:
+            if move.is_castling and move.end_col == col:
+                return move
+        return None
+
+    promotion = 'q'
+    if '=' in san:
+        san, promotion = san.split('=')
+        promotion = promotion[:1].lower()
+    elif san[-1] in 'QRBN' and san[0].islower():
+        san, promotion = san[:-1], san[-1].lower()
+
+    if len(san) < 2 or san[-2] not in engine.FILES_TO_COLS or \
+            san[-1] not in engine.RANKS_TO_ROWS:
+        return None
+
+    piece = san[0].lower() if san[0] in 'KQRBN' else 'p'
+    end_row = engine.RANKS_TO_ROWS[san[-1]]
+    end_col = engine.FILES_TO_COLS[san[-2]]
+    disambiguation = san[0 if piece == 'p' else 1:-2].replace('x', '')
+
+    found = [move for move in moves
+             if move.piece_moved[1] == piece and move.end_row == end_row and
+             move.end_col == end_col and
+             (not move.is_pawn_promotion or move.promotion == promotion) and
+             all(char in engine.get_rank_file(move.start_row, move.start_col)
+                 for char in disambiguation)]
+
+    return found[0] if len(found) == 1 else None
+
+
+def read_games(path):
+    # the tag pairs and movetext of each game in a pgn file
+    tags = {}
+    movetext = []
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                if movetext:
+                    yield tags, ' '.join(movetext)
+                    tags, movetext = {}, []
+                match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+                if match:
+                    tags[match.group(1)] = match.group(2)
+            elif line and not line.startswith('%'):
+                movetext.append(line.split(';')[0])
+
+    if movetext:
+        yield tags, ' '.join(movetext)
+
+
+def get_san_moves(movetext):
+    # drop comments, variations, annotations and move numbers
+    movetext = re.sub(r'\{[^}]*\}', ' ', movetext)
+    while '(' in movetext:
+        stripped = re.sub(r'\([^()]*\)', ' ', movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    movetext = re.sub(r'\$\d+', ' ', movetext)
+    movetext = re.sub(r'\d+\.+', ' ', movetext)
+
+    for token in movetext.split():
+        if token in ('1-0', '0-1', '1/2-1/2', '*'):
+            break
+        yield token
+
+
+def count_book_moves(pgn_paths, max_plies):
+    counts = Counter()
+    games = 0
+
+    for path in pgn_paths:
+        for tags, movetext in read_games(path):
+            game_state = engine.GameState(game_type='standard',
+                                          fen=tags.get('FEN'))
+            moves = game_state.valid_moves
+
+            for ply, san in enumerate(get_san_moves(movetext)):
+                if ply == max_plies:
+                    break
+
+                move = get_san_move(moves, san)
+                if move is None:
+                    break
+
+                counts[game_state.hash_key, move.move_id] += 1
+                game_state.make_move(move, quick=True)
+                moves = game_state.get_valid_moves(return_moves=True)
+
+            games += 1
+
+    return counts, games
+
+
+def build_book(pgn_paths, book_path, max_plies=20, min_count=2):
+    counts, games = count_book_moves(pgn_paths, max_plies)
+
+    records = sorted((key, move_id, min(count, MAX_WEIGHT))
+                     for (key, move_id), count in counts.items()
+                     if count >= min_count)
+
+    with open(book_path, 'wb') as f:
+        for record in records:
+            f.write(RECORD.pack(*record))
+
+    return games, len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compile pgn game collections into an opening book.')
+    parser.add_argument('book')
+    parser.add_argument('pgn', nargs='+')
+    parser.add_argument('--plies', type=int, default=20,
+                        help='how many moves into each game to take')
+    parser.add_argument('--min-count', type=int, default=2,
+                        help='leave out moves played fewer times than this')
+    args = parser.parse_args()
+
+    games, records = build_book(args.pgn, args.book, args.plies,
+                                args.min_count)
+    print('{} moves from {} games written to {}'.format(records, games,
+                                                        args.book))
@@ -98,6 +98,7 @@ class Programme:
         self.game_type = game_type
 
         if self.network is not None:
+            self.game_state = None
             self.get_game_state()
         else:
             self.game_state = engine.GameState(game_mode=self.game_mode,
@@ -118,9 +119,11 @@ class Programme:
 
         if self.game_mode == 'singleplayer':
             self.comp = ai.AI()
+            self.searcher = ai.Searcher(self.comp)
             self.moves_to_execute_ai = []
         else:
             self.comp = None
+            self.searcher = None
             self.moves_to_execute_ai = None
 
         self.player_one = True if player == 0 else False
@@ -136,7 +139,7 @@ class Programme:
         self.prog_running = True
 
     def get_game_state(self):
-        self.game_state = self.network.send('get')
+        self.game_state = self.network.get_game_state(self.game_state)
 
     def tick_clock(self):
         self.clock.tick(self.max_fps)
@@ -462,6 +465,12 @@ class Programme:
             self.draw_end_game_text('Dead position')
             self.draw_result('1/2-1/2')
 
+        # the search's worker processes aren't left running once the game is
+        # over, unless a search is still using them
+        if self.game_state.game_over and self.searcher is not None and \
+                not self.looking_for_ai_move:
+            self.searcher.close()
+
     def update_human_turn(self):
         self.human_turn = (self.game_state.white_move and
                            self.player_one) or \
@@ -557,10 +566,13 @@ class Programme:
                 if move == m:
                     #ntwrk.send(str(num))
                     try:
-                        self.network.send(num)
-                        #self.network.send(move)
-                    except EOFError:
-                        print('EOFError')
+                        #self.network.send(num)
+                        self.game_state = self.network.send_move(
+                            m.move_id, self.game_state)
+                    except (EOFError, ConnectionError) as e:
+                        # the server is gone, so is the game
+                        print(e)
+                        self.prog_running = False
 
                     self.move_made = True
                     break
@@ -1,12 +1,51 @@
+from bisect import insort
 from collections import Counter
-from copy import deepcopy
+from random import Random
 from time import time
 
+from piece_square_tables import MAX_PHASE, PHASES, PIECE_SQUARE_TABLES
+
+
+EMPTY = '--'
+
+ALL_SQUARES = (1 << 64) - 1
+
+PROMOTIONS = ('q', 'r', 'b', 'n')
+
+PIECES = ('wk', 'wq', 'wr', 'wb', 'wn', 'wp',
+          'bk', 'bq', 'br', 'bb', 'bn', 'bp')
+
+# a piece as a small number, 0 for an empty square and the pieces numbered
+# in PIECES order
+PIECE_CODES = {EMPTY: 0}
+PIECE_CODES.update({piece: i + 1 for i, piece in enumerate(PIECES)})
+
+CODES_TO_PIECES = {v: k for k, v in PIECE_CODES.items()}
+
+# fixed seed so hash keys are the same in every process and every run
+zobrist_random = Random(1998)
+
+ZOBRIST_PIECES = {piece: [zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in PIECES}
+ZOBRIST_CASTLING = {side: zobrist_random.getrandbits(64)
+                    for side in ('wk', 'wq', 'bk', 'bq')}
+ZOBRIST_ENPASSANT = [zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_MOVE = zobrist_random.getrandbits(64)
+
 
 class GameState:
-    def __init__(self, ID=0, game_mode='singleplayer', game_type='blitz'):
+    def __init__(self, ID=0, game_mode='singleplayer', game_type='blitz',
+                 fen=None, piece_square_tables=PIECE_SQUARE_TABLES):
         self.id = ID
 
+        # needed before the board is set up as putting pieces on it keeps
+        # the positional score
+        self.middlegame_tables, self.endgame_tables = \
+            get_signed_tables(piece_square_tables)
+
+        # the position is held as one bitboard per piece plus occupancy,
+        # square = row * 8 + col so a8 is bit 0 and h1 is bit 63, and
+        # squares is a flat mailbox used to look up the piece on a square
         self.board = [['br', 'bn', 'bb', 'bq', 'bk', 'bb', 'bn', 'br'],
                       ['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
                       ['--', '--', '--', '--', '--', '--', '--', '--'],
@@ -16,7 +55,6 @@ class GameState:
                       ['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
                       ['wr', 'wn', 'wb', 'wq', 'wk', 'wb', 'wn', 'wr']]
 
-        self.board_log = [deepcopy(self.board)]
 
         self.pieces_order = {'k': 1, 'q': 2, 'r': 3, 'b': 4, 'n': 5, 'p': 6}
         self.all_board_pieces_counter = Counter(['k', 'q', 'r', 'r',
@@ -31,16 +69,20 @@ class GameState:
         self.move_log = []
         self.valid_move_log = []
 
+        # one record per move made holding what make_move can't recover from
+        # the move itself, so undo_move can reverse it in place
+        self.undo_log = []
+
         #self.moves_to_execute_white = []
         #self.moves_to_execute_black = []
 
-        self.white_king = (7, 4)
-        self.black_king = (0, 4)
-
+        # counted once here and then kept up to date by make_move and
+        # undo_move as pieces are captured and pawns promoted
         self.white_has = []
         self.black_has = []
         self.white_taken = []
         self.black_taken = []
+        self.material = {'w': 0, 'b': 0}
         self.white_score = 0
         self.black_score = 0
         self.get_pieces_taken()
@@ -50,15 +92,16 @@ class GameState:
         self.checks = []
 
         self.enpassant = ()
-        self.enpassant_log = [self.enpassant]
 
         self.castling = {'bq': True, 'bk': True, 'wq': True, 'wk': True}
-        self.castling_log = [self.castling.copy()]
+
+        # zobrist key of the position, kept up to date by make_move and
+        # undo_move, with one entry per position reached in hash_log
+        self.hash_key = self.get_hash_key()
+        self.hash_log = [self.hash_key]
 
         self.moves_since_pawn_move = 0
         self.moves_since_capture = 0
-        self.moves_since_pawn_move_log = [0]
-        self.moves_since_capture_log = [0]
 
         self.checkmate = False
         self.stalemate = False
@@ -80,12 +123,182 @@ class GameState:
         self.get_valid_moves()
         self.get_times()
 
+        if fen is not None:
+            self.set_fen(fen)
+
+    @property
+    def board(self):
+        return [self.squares[row * 8:row * 8 + 8] for row in range(8)]
+
+    @board.setter
+    def board(self, board):
+        self.squares = [EMPTY] * 64
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {'w': 0, 'b': 0}
+        self.occupied = 0
+        self.hash_key = 0
+        self.middlegame_score = 0
+        self.endgame_score = 0
+        self.phase = 0
+
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] != EMPTY:
+                    self.put_piece(row * 8 + col, board[row][col])
+
+        self.white_king = get_row_col(self.bitboards['wk'])
+        self.black_king = get_row_col(self.bitboards['bk'])
+
+    def set_fen(self, fen):
+        # the halfmove clock is used for both move counters and the full
+        # move number is ignored
+        fields = fen.split()
+        fields += ['w', '-', '-', '0'][len(fields) - 1:]
+
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row += [EMPTY] * int(char)
+                else:
+                    row.append(('w' if char.isupper() else 'b') +
+                               char.lower())
+            board.append(row)
+
+        castling = {'bq': 'q' in fields[2], 'bk': 'k' in fields[2],
+                    'wq': 'Q' in fields[2], 'wk': 'K' in fields[2]}
+        enpassant = () if fields[3] == '-' else \
+            (RANKS_TO_ROWS[fields[3][1]], FILES_TO_COLS[fields[3][0]])
+
+        self.set_position(board, fields[1] == 'w', castling, enpassant,
+                          int(fields[4]))
+
+    def set_position(self, board, white_move, castling, enpassant,
+                     halfmoves):
+        self.board = board
+        self.white_move = white_move
+        self.castling = castling
+        self.enpassant = enpassant
+        self.moves_since_pawn_move = halfmoves
+        self.moves_since_capture = halfmoves
+
+        self.move_log = []
+        self.valid_move_log = []
+        self.undo_log = []
+        self.hash_key = self.get_hash_key()
+        self.hash_log = [self.hash_key]
+
+        self.checkmate = False
+        self.stalemate = False
+        self.is_three_fold = False
+        self.is_fifty_rule = False
+        self.is_impossibility = False
+
+        self.get_pieces_taken()
+        self.get_valid_moves()
+
+    def get_fen(self):
+        castling = ''.join(letter for side, letter in (('wk', 'K'),
+                                                       ('wq', 'Q'),
+                                                       ('bk', 'k'),
+                                                       ('bq', 'q'))
+                           if self.castling[side]) or '-'
+        enpassant = get_rank_file(*self.enpassant) if self.enpassant else '-'
+        halfmoves = min(self.moves_since_pawn_move, self.moves_since_capture)
+
+        return ' '.join((get_board_fen(self.squares),
+                         'w' if self.white_move else 'b',
+                         castling, enpassant, str(halfmoves),
+                         str(len(self.move_log) // 2 + 1)))
+
+    def put_piece(self, square, piece):
+        bit = 1 << square
+        self.squares[square] = piece
+        self.bitboards[piece] |= bit
+        self.occupancy[piece[0]] |= bit
+        self.occupied |= bit
+        self.hash_key ^= ZOBRIST_PIECES[piece][square]
+        self.middlegame_score += self.middlegame_tables[piece][square]
+        self.endgame_score += self.endgame_tables[piece][square]
+        self.phase += PHASES[piece[1]]
+
+    def remove_piece(self, square):
+        bit = 1 << square
+        piece = self.squares[square]
+        self.squares[square] = EMPTY
+        self.bitboards[piece] ^= bit
+        self.occupancy[piece[0]] ^= bit
+        self.occupied ^= bit
+        self.hash_key ^= ZOBRIST_PIECES[piece][square]
+        self.middlegame_score -= self.middlegame_tables[piece][square]
+        self.endgame_score -= self.endgame_tables[piece][square]
+        self.phase -= PHASES[piece[1]]
+
+        return piece
+
+    def set_piece_square_tables(self, piece_square_tables):
+        self.middlegame_tables, self.endgame_tables = \
+            get_signed_tables(piece_square_tables)
+        self.get_positional_scores()
+
+    def get_positional_scores(self):
+        self.middlegame_score = 0
+        self.endgame_score = 0
+        self.phase = 0
+
+        for square, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                self.middlegame_score += self.middlegame_tables[piece][square]
+                self.endgame_score += self.endgame_tables[piece][square]
+                self.phase += PHASES[piece[1]]
+
+    def get_positional_score(self):
+        # white minus black in pawns, moving from the middlegame tables to
+        # the endgame ones as the pieces come off
+        phase = min(self.phase, MAX_PHASE)
+
+        return (self.middlegame_score * phase +
+                self.endgame_score * (MAX_PHASE - phase)) / (MAX_PHASE * 100)
+
+    def get_hash_key(self):
+        hash_key = 0
+
+        for square, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                hash_key ^= ZOBRIST_PIECES[piece][square]
+
+        for side, allowed in self.castling.items():
+            if allowed:
+                hash_key ^= ZOBRIST_CASTLING[side]
+
+        if not self.white_move:
+            hash_key ^= ZOBRIST_BLACK_MOVE
+
+        return hash_key ^ self.get_enpassant_key()
+
+    def get_enpassant_key(self):
+        # the en passant square only changes the position if the side to
+        # move has a pawn that can actually take on it
+        if self.enpassant == ():
+            return 0
+
+        row, col = self.enpassant
+        pawn_row = row + 1 if self.white_move else row - 1
+        pawns = self.bitboards['wp' if self.white_move else 'bp'] >> \
+            (pawn_row * 8) & 0xff
+
+        if pawns & ((0b101 << col) >> 1):
+            return ZOBRIST_ENPASSANT[col]
+
+        return 0
+
     def __str__(self):
         string = ''
 
         for row in range(8):
             for col in range(8):
-                string += self.board[row][col]
+                string += self.squares[row * 8 + col]
                 string += ''
             string += '\n'
 
@@ -94,7 +307,7 @@ class GameState:
     def __eq__(self, other_board):
         for row in range(8):
             for col in range(8):
-                if self.board[row][col] != other_board[row][col]:
+                if self.squares[row * 8 + col] != other_board[row][col]:
                     return False
 
         return True
@@ -152,8 +365,32 @@ class GameState:
                 self.start_timer()
                 self.game_started = True
 
-        self.board[move.start_row][move.start_col] = '--'
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        start = move.move_id & 63
+        end = move.move_id >> 6 & 63
+
+        hash_key = self.hash_key
+        castling = self.castling.copy()
+
+        self.hash_key ^= self.get_enpassant_key() ^ ZOBRIST_BLACK_MOVE
+
+        captured = EMPTY
+        if move.is_enpassant:
+            captured = self.remove_piece(move.start_row * 8 + move.end_col)
+        elif self.squares[end] != EMPTY:
+            captured = self.remove_piece(end)
+
+        self.undo_log.append((captured, castling, self.enpassant,
+                              self.moves_since_pawn_move,
+                              self.moves_since_capture, self.in_check,
+                              hash_key))
+
+        self.remove_piece(start)
+
+        if move.is_pawn_promotion:
+            self.put_piece(end, move.piece_moved[0] + move.promotion)
+        else:
+            self.put_piece(end, move.piece_moved)
+
         self.move_log.append(move)
         self.white_move = not self.white_move
 
@@ -162,12 +399,6 @@ class GameState:
         elif move.piece_moved == 'bk':
             self.black_king = (move.end_row, move.end_col)
 
-        if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'q'
-
-        if move.is_enpassant:
-            self.board[move.start_row][move.end_col] = '--'
-
         if move.piece_moved[1] == 'p' and \
                 abs(move.start_row - move.end_row) == 2:
             self.enpassant = ((move.start_row + move.end_row)//2,
@@ -175,8 +406,6 @@ class GameState:
         else:
             self.enpassant = ()
 
-        self.enpassant_log.append(self.enpassant)
-
         # castling
         if move.piece_moved == 'wk':
             self.castling['wq'] = False
@@ -199,13 +428,9 @@ class GameState:
 
         if move.is_castling:
             if move.end_col - move.start_col == 2:
-                self.board[move.end_row][move.end_col-1] = self.board[
-                    move.end_row][move.end_col+1]
-                self.board[move.end_row][move.end_col+1] = '--'
+                self.put_piece(end - 1, self.remove_piece(end + 1))
             else:
-                self.board[move.end_row][move.end_col+1] = self.board[
-                    move.end_row][move.end_col-2]
-                self.board[move.end_row][move.end_col-2] = '--'
+                self.put_piece(end + 1, self.remove_piece(end - 2))
 
         if move.piece_captured == 'wr':
             if move.end_row == 7:
@@ -220,15 +445,14 @@ class GameState:
                 elif move.end_col == 7:
                     self.castling['bk'] = False
 
-        self.castling_log.append(self.castling.copy())
-
-        self.board_log.append(deepcopy(self.board))
+        for side, allowed in castling.items():
+            if allowed != self.castling[side]:
+                self.hash_key ^= ZOBRIST_CASTLING[side]
 
-        self.get_pieces_taken()
+        self.hash_key ^= self.get_enpassant_key()
+        self.hash_log.append(self.hash_key)
 
-        if len(self.board_log) >= 9 and \
-                self.board_log[-1] == self.board_log[-5] == self.board_log[-9]:
-            self.is_three_fold = True
+        self.update_pieces_taken(move, captured)
 
         if move.piece_moved[1] == 'p':
             self.moves_since_pawn_move = 0
@@ -240,48 +464,19 @@ class GameState:
         else:
             self.moves_since_capture += 1
 
-        self.moves_since_pawn_move_log.append(self.moves_since_pawn_move)
-        self.moves_since_capture_log.append(self.moves_since_capture)
+        if self.count_repetitions() >= 2:
+            self.is_three_fold = True
 
         if self.moves_since_pawn_move >= 100 and \
                 self.moves_since_capture >= 100:
             self.is_fifty_rule = True
 
-        # white_has and black_has are updated in self.get_pieces_taken()
-        if len(self.white_has) == 1:
-            if len(self.black_has) == 1:
-                self.is_impossibility = True
-            elif len(self.black_has) == 2:
-                if 'b' in self.black_has or 'n' in self.black_has:
-                    self.is_impossibility = True
-        elif len(self.white_has) == 2 and 'b' in self.white_has:
-            c1 = -1
-            c2 = -2
-            for row in range(8):
-                for col in range(8):
-                    if self.board[row][col] == 'wb':
-                        c1 = (row + col) % 2
-                    elif self.board[row][col] == 'bb':
-                        c2 = (row + col) % 2
-                if c1 == c2:
-                    self.is_impossibility = True
-        elif len(self.black_has) == 1:
-            if len(self.white_has) == 1:
-                self.is_impossibility = True
-            elif len(self.white_has) == 2:
-                if 'b' in self.white_has or 'n' in self.white_has:
-                    self.is_impossibility = True
-        elif len(self.black_has) == 2 and 'b' in self.black_has:
-            c1 = -1
-            c2 = -2
-            for row in range(8):
-                for col in range(8):
-                    if self.board[row][col] == 'bb':
-                        c1 = (row + col) % 2
-                    elif self.board[row][col] == 'wb':
-                        c2 = (row + col) % 2
-                if c1 == c2:
-                    self.is_impossibility = True
+        if self.is_insufficient_material():
+            self.is_impossibility = True
+
+        # a search asks for the moves it needs with get_staged_moves
+        if quick:
+            return
 
         self.get_valid_moves()
 
@@ -297,99 +492,71 @@ class GameState:
             move = self.move_log.pop()
             self.white_move = not self.white_move
 
-            '''
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            captured, self.castling, self.enpassant, \
+                self.moves_since_pawn_move, self.moves_since_capture, \
+                self.in_check, hash_key = self.undo_log.pop()
 
-            if move.piece_moved == 'wk':
-                self.white_king = (move.start_row, move.start_col)
-            elif move.piece_moved == 'bk':
-                self.black_king = (move.start_row, move.start_col)
+            start = move.move_id & 63
+            end = move.move_id >> 6 & 63
+
+            self.remove_piece(end)
+            self.put_piece(start, move.piece_moved)
 
             if move.is_enpassant:
-                self.board[move.end_row][move.end_col] = '--'
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                
-            if move.piece_moved[1] == 'p' and abs(move.start_row -
-                                      move.end_row) == 2:
-                self.enpassant = ()
+                self.put_piece(move.start_row * 8 + move.end_col, captured)
+            elif captured != EMPTY:
+                self.put_piece(end, captured)
 
             if move.is_castling:
                 if move.end_col - move.start_col == 2:
-                    self.board[move.end_row][move.end_col+1] = self.board[
-                        move.end_row][move.end_col-1]
-                    self.board[move.end_row][move.end_col-1] = '--'
+                    self.put_piece(end + 1, self.remove_piece(end - 1))
                 else:
-                    self.board[move.end_row][move.end_col-2] = self.board[
-                        move.end_row][move.end_col+1]
-                    self.board[move.end_row][move.end_col+1] = '--'
-            '''
-
-            self.enpassant_log.pop()
-            self.enpassant = self.enpassant_log[-1]
+                    self.put_piece(end - 2, self.remove_piece(end + 1))
 
-            self.castling_log.pop()
-            self.castling = self.castling_log[-1].copy()
-
-            self.moves_since_pawn_move_log.pop()
-            self.moves_since_pawn_move = self.moves_since_pawn_move_log[-1]
-
-            self.moves_since_capture_log.pop()
-            self.moves_since_capture = self.moves_since_capture_log[-1]
+            if move.piece_moved == 'wk':
+                self.white_king = (move.start_row, move.start_col)
+            elif move.piece_moved == 'bk':
+                self.black_king = (move.start_row, move.start_col)
 
-            self.board_log.pop()
-            self.board = deepcopy(self.board_log[-1])
+            self.hash_key = hash_key
+            self.hash_log.pop()
 
-            self.get_pieces_taken()
+            self.revert_pieces_taken(move, captured)
 
-            self.in_check = False
             self.checkmate = False
             self.stalemate = False
             self.is_three_fold = False
             self.is_fifty_rule = False
+            self.is_impossibility = False
+
+            if not quick:
+                self.valid_move_log.pop()
+                self.valid_moves = self.valid_move_log[-1]
 
-            #self.get_valid_moves()
-            self.valid_move_log.pop()
-            self.valid_moves = self.valid_move_log[-1]
+    def count_repetitions(self):
+        # earlier occurrences of the current position, only looking back to
+        # the last pawn move or capture and only at the same side to move
+        count = 0
+        last = len(self.hash_log) - 1
+        first = last - min(self.moves_since_pawn_move,
+                           self.moves_since_capture)
+
+        for i in range(last - 4, max(first, 0) - 1, -2):
+            if self.hash_log[i] == self.hash_key:
+                count += 1
+
+        return count
 
     def get_valid_moves(self, return_moves=False):
         temp_enpassant = self.enpassant
 
-        moves = [] #self.get_all_moves()
-
         self.in_check, self.pins, self.checks = self.get_pins_and_checks()
 
-        king_row, king_col = self.white_king if self.white_move else \
-            self.black_king
-
         if self.in_check:
-            if len(self.checks) == 1:
-                moves = self.get_all_moves()
-                check = self.checks[0]
-                check_row, check_col = check[0], check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []
-                if piece_checking[1] == 'n':
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        # check[2] and check[3] are the check directions
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and \
-                            valid_square[1] == check_col:
-                            break
-                for i in range(len(moves)-1, -1, -1):
-                    if moves[i].piece_moved[1] != 'k':
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:
-                            moves.remove(moves[i])
-            else:
-                # more than one checking piece means only king moving is valid
-                self.get_king_moves(king_row, king_col, moves)
+            moves = self.get_evasion_moves()
         else:
             moves = self.get_all_moves()
+            self.get_enpassant_moves(moves)
             self.get_castling_moves(moves)
 
         self.enpassant = temp_enpassant
@@ -406,283 +573,383 @@ class GameState:
             self.valid_move_log.append(moves)
             self.valid_moves = moves
 
-    def get_all_moves(self):
+    def get_staged_moves(self, hash_move_id=None, key=None):
+        # yields the legal moves a stage at a time, the hash move, then
+        # captures, then quiet moves, each stage one piece at a time, so a
+        # search that cuts off early never generates the rest, or with a key
+        # each stage is generated whole and yielded best first
+        in_check, pins, checks = self.get_pins_and_checks()
+        self.in_check, self.pins, self.checks = in_check, pins, checks
+
+        hash_id = -1
+        if hash_move_id is not None:
+            for move in self.get_square_moves(hash_move_id & 63):
+                if move.move_id == hash_move_id:
+                    hash_id = move.move_id
+                    yield move
+                    break
+
+        if in_check:
+            # searching the hash move will have reset these
+            self.in_check, self.pins, self.checks = in_check, pins, checks
+            moves = self.get_evasion_moves()
+            if key is not None:
+                moves.sort(key=key, reverse=True)
+            for move in moves:
+                if move.move_id != hash_id:
+                    yield move
+            return
+
+        ally_color, enemy_color = ('w', 'b') if self.white_move else \
+            ('b', 'w')
+
+        for targets in (self.occupancy[enemy_color],
+                        ~self.occupied & ALL_SQUARES):
+            if key is None:
+                pieces = self.occupancy[ally_color]
+                while pieces:
+                    bit = pieces & -pieces
+                    pieces ^= bit
+                    moves = []
+                    # a search below the last yield will have reset the pins
+                    self.pins = pins
+                    self.get_piece_moves(bit.bit_length() - 1, moves,
+                                         targets)
+                    for move in moves:
+                        if move.move_id != hash_id:
+                            yield move
+                moves = []
+            else:
+                self.pins = pins
+                moves = self.get_all_moves(targets)
+
+            if targets & self.occupied:
+                self.get_enpassant_moves(moves)
+            else:
+                self.in_check = in_check
+                self.get_castling_moves(moves)
+
+            if key is not None:
+                moves.sort(key=key, reverse=True)
+            for move in moves:
+                if move.move_id != hash_id:
+                    yield move
+
+    def get_capture_moves(self):
+        self.in_check, self.pins, self.checks = self.get_pins_and_checks()
+
+        if self.in_check:
+            return self.get_evasion_moves()
+
+        moves = self.get_all_moves(
+            self.occupancy['b' if self.white_move else 'w'])
+        self.get_enpassant_moves(moves)
+
+        return moves
+
+    def has_legal_moves(self):
+        for _ in self.get_staged_moves():
+            return True
+
+        return False
+
+    def get_evasion_moves(self):
+        # only king moves, captures of the checking piece and moves that
+        # block it, with just the king allowed to move in double check
+        king_row, king_col = self.white_king if self.white_move else \
+            self.black_king
+
         moves = []
+        self.get_king_moves(king_row, king_col, moves)
 
-        for row in range(8):
-            for col in range(8):
-                color = self.board[row][col][0]
-                if (color == 'w' and self.white_move) or \
-                    (color == 'b' and not self.white_move):
-                    piece = self.board[row][col][1]
-                    if piece == 'p':
-                        self.get_pawn_moves(row, col, moves)
-                    elif piece == 'r':
-                        self.get_rook_moves(row, col, moves)
-                    elif piece == 'n':
-                        self.get_knight_moves(row, col, moves)
-                    elif piece == 'b':
-                        self.get_bishop_moves(row, col, moves)
-                    elif piece == 'q':
-                        self.get_queen_moves(row, col, moves)
-                    elif piece == 'k':
-                        self.get_king_moves(row, col, moves)
+        targets = self.get_check_targets()
+        if targets:
+            moves += self.get_all_moves(targets, king=False)
+            self.get_enpassant_moves(moves)
 
         return moves
 
+    def get_check_targets(self):
+        # the checking piece and, for a slider, the squares between it and
+        # the king, or nothing when there is more than one check
+        if len(self.checks) != 1:
+            return 0
+
+        row, col, d_row, d_col = self.checks[0]
+        square = row * 8 + col
+        if self.squares[square][1] in 'np':
+            return 1 << square
+
+        king_row, king_col = self.white_king if self.white_move else \
+            self.black_king
+        j = DIRECTIONS.index((d_row, d_col))
+
+        return RAYS[j][king_row * 8 + king_col] ^ RAYS[j][square]
+
+    def get_all_moves(self, targets=ALL_SQUARES, king=True):
+        moves = []
+
+        # walk the set bits of our own occupancy rather than all 64 squares
+        pieces = self.occupancy['w' if self.white_move else 'b']
+        if not king:
+            pieces &= ~self.bitboards['wk' if self.white_move else 'bk']
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            self.get_piece_moves(bit.bit_length() - 1, moves, targets)
+
+        return moves
+
+    def get_piece_moves(self, square, moves, targets):
+        row, col = square >> 3, square & 7
+        piece = self.squares[square][1]
+        if piece == 'p':
+            self.get_pawn_moves(row, col, moves, targets)
+        elif piece == 'r':
+            self.get_rook_moves(row, col, moves, targets)
+        elif piece == 'n':
+            self.get_knight_moves(row, col, moves, targets)
+        elif piece == 'b':
+            self.get_bishop_moves(row, col, moves, targets)
+        elif piece == 'q':
+            self.get_queen_moves(row, col, moves, targets)
+        elif piece == 'k':
+            self.get_king_moves(row, col, moves, targets)
+
+    def get_square_moves(self, square):
+        # every legal move of the piece on one square, used to check that a
+        # move from somewhere else, like the hash move, is legal here
+        moves = []
+        if not self.occupancy['w' if self.white_move else 'b'] & \
+                (1 << square):
+            return moves
+
+        if self.squares[square][1] == 'k':
+            self.get_king_moves(square >> 3, square & 7, moves)
+            self.get_castling_moves(moves)
+        else:
+            targets = self.get_check_targets() if self.in_check else \
+                ALL_SQUARES
+            self.get_piece_moves(square, moves, targets)
+            if targets:
+                self.get_enpassant_moves(moves)
+
+        return [move for move in moves
+                if move.move_id & 63 == square]
+
     def get_pins_and_checks(self):
         pins = []
         checks = []
-        in_check = False
         enemy_color, ally_color,\
         start_row, start_col = ('b', 'w',
                                 self.white_king[0],
                                 self.white_king[1]) if self.white_move else \
             ('w', 'b', self.black_king[0], self.black_king[1])
-        directions = ((-1,  0), (0, -1), (1,  0), (0, 1), # for rooks
-                      (-1, -1), (-1, 1), (1, -1), (1, 1)) # for bishops
-        for j in range(len(directions)):
-            d = directions[j]
+        king = start_row * 8 + start_col
+        ally = self.occupancy[ally_color] & ~self.bitboards[ally_color + 'k']
+        enemy = self.occupancy[enemy_color]
+        rooks = self.bitboards[enemy_color + 'r'] | \
+            self.bitboards[enemy_color + 'q']
+        bishops = self.bitboards[enemy_color + 'b'] | \
+            self.bitboards[enemy_color + 'q']
+        for j in range(8):
+            # only walk the rays that have an enemy slider somewhere on them
+            sliders = rooks if j < 4 else bishops
+            if not RAYS[j][king] & sliders:
+                continue
+            d = DIRECTIONS[j]
             possible_pin = ()
             for i in range(1, 8):
                 end_row = start_row + d[0] * i
                 end_col = start_col + d[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != 'k':
-                        # can't be a pin if we already have one
+                bit = 1 << (end_row * 8 + end_col)
+                if ally & bit:
+                    # can't be a pin if we already have one
+                    if possible_pin == ():
+                        possible_pin = (end_row, end_col, d[0], d[1])
+                    else:
+                        break
+                elif enemy & bit:
+                    if sliders & bit:
+                        # no piece blocking so check
                         if possible_pin == ():
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else:
-                            break
-                    elif end_piece[0] == enemy_color:
-                        type_ = end_piece[1]
-                        if (0 <= j <= 3 and type_ == 'r') or \
-                                (4 <= j <= 7 and type_ == 'b') or \
-                                (i == 1 and type_ == 'p' and ((
-                                    enemy_color == 'w' and 6 <= j <= 7) or (
-                                        enemy_color == 'b' and 4 <= j <=
-                                        5))) or (type_ == 'q') or (i == 1
-                                                                   and type_
-                                                                   == 'k'):
-                            # no piece blocking so check
-                            if possible_pin == ():
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            # piece blocking so pin
-                            else:
-                                pins.append(possible_pin)
-                                break
-                        # enemy piece not applying check
+                            checks.append((end_row, end_col, d[0], d[1]))
+                        # piece blocking so pin
                         else:
-                            break
-
-        # knight checks
-        directions = ((-2, -1), (-2, 1), (2, -1), (2, 1),
-                      (-1, -2), (-1, 2), (1, -2), (1, 2))
-        for d in directions:
-            end_row = start_row + d[0]
-            end_col = start_col + d[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == 'n':
-                    in_check = True
-                    checks.append((end_row, end_col, d[0], d[1]))
-
-        return in_check, pins, checks
-
-    def check_pinned(self, row, col, rook=False):
+                            pins.append(possible_pin)
+                    break
+
+        # pawn and knight checks
+        attackers = PAWN_ATTACKS[ally_color][king] & \
+            self.bitboards[enemy_color + 'p'] | \
+            KNIGHT_ATTACKS[king] & self.bitboards[enemy_color + 'n']
+        while attackers:
+            bit = attackers & -attackers
+            attackers ^= bit
+            end_row, end_col = get_row_col(bit)
+            checks.append((end_row, end_col,
+                           end_row - start_row, end_col - start_col))
+
+        return len(checks) > 0, pins, checks
+
+    def check_pinned(self, row, col):
         for i in range(len(self.pins) - 1, -1, -1):
             if self.pins[i][0] == row and self.pins[i][1] == col:
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                # can't remove queen from pin on rook moves
-                # only remove it on bishop moves
-                if rook and self.board[row][col] != 'q':
-                    self.pins.remove(self.pins[i])
                 return True, pin_direction
         return False, ()
 
-    def get_pawn_moves(self, row, col, moves):
+    def get_attackers(self, square, color, occupied):
+        # look outward from the square for pieces of color that attack it
+        bitboards = self.bitboards
+        attackers = KNIGHT_ATTACKS[square] & bitboards[color + 'n'] | \
+            KING_ATTACKS[square] & bitboards[color + 'k'] | \
+            PAWN_ATTACKS['b' if color == 'w' else 'w'][square] & \
+            bitboards[color + 'p']
+
+        rooks = bitboards[color + 'r'] | bitboards[color + 'q']
+        if rooks:
+            attackers |= get_rook_attacks(square, occupied) & rooks
+
+        bishops = bitboards[color + 'b'] | bitboards[color + 'q']
+        if bishops:
+            attackers |= get_bishop_attacks(square, occupied) & bishops
+
+        return attackers
+
+    def add_move(self, start, end, moves, pawn_promotion=False,
+                 enpassant=False, castling=False):
+        if pawn_promotion:
+            for promotion in PROMOTIONS:
+                moves.append(Move((start >> 3, start & 7),
+                                  (end >> 3, end & 7), None,
+                                  pawn_promotion=True,
+                                  promotion=promotion,
+                                  piece_moved=self.squares[start],
+                                  piece_captured=self.squares[end]))
+            return
+
+        moves.append(Move((start >> 3, start & 7), (end >> 3, end & 7), None,
+                          enpassant=enpassant,
+                          castling=castling,
+                          piece_moved=self.squares[start],
+                          piece_captured=self.squares[end]))
+
+    def add_moves(self, start, targets, moves):
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            self.add_move(start, bit.bit_length() - 1, moves)
+
+    def get_pawn_moves(self, row, col, moves, targets=ALL_SQUARES):
         piece_pinned, pin_direction = self.check_pinned(row, col)
 
-        if self.white_move:
-            pawn_promotion = True if row-1 == 0 else False
-            if self.board[row-1][col] == '--':
-                if not piece_pinned or pin_direction == (-1, 0):
-                    moves.append(Move((row, col),
-                                      (row-1, col),
-                                      self.board,
-                                      pawn_promotion=pawn_promotion))
-                    if row == 6 and self.board[row-2][col] == '--':
-                        moves.append(Move((row, col),
-                                          (row-2, col),
-                                          self.board))
-            if col-1 >= 0:
-                if not piece_pinned or pin_direction == (-1, -1):
-                    if self.board[row-1][col-1][0] == 'b':
-                        moves.append(Move((row, col),
-                                          (row-1, col-1),
-                                          self.board,
-                                          pawn_promotion=pawn_promotion))
-                    elif (row-1, col-1) == self.enpassant:
-                        moves.append(Move((row, col),
-                                          (row-1, col-1),
-                                          self.board,
-                                          enpassant=True))
-            if col+1 <= 7:
-                if not piece_pinned or pin_direction == (-1, 1):
-                    if self.board[row-1][col+1][0] == 'b':
-                        moves.append(Move((row, col),
-                                          (row-1, col+1),
-                                          self.board,
-                                          pawn_promotion=pawn_promotion))
-                    elif (row-1, col+1) == self.enpassant:
-                        moves.append(Move((row, col),
-                                          (row-1, col+1),
-                                          self.board,
-                                          enpassant=True))
+        square = row * 8 + col
 
+        if self.white_move:
+            forward, last_row, start_row, enemy = -1, 0, 6, \
+                self.occupancy['b']
         else:
-            pawn_promotion = True if row+1 == 7 else False
-            if self.board[row+1][col] == '--':
-                if not piece_pinned or pin_direction == (1, 0):
-                    moves.append(Move((row, col),
-                                      (row+1, col),
-                                      self.board,
-                                      pawn_promotion=pawn_promotion))
-                    if row == 1 and self.board[row+2][col] == '--':
-                        moves.append(Move((row, col),
-                                          (row+2, col),
-                                          self.board))
-            if col-1 >= 0:
-                if not piece_pinned or pin_direction == (1, -1):
-                    if self.board[row+1][col-1][0] == 'w':
-                        moves.append(Move((row, col),
-                                          (row+1, col-1),
-                                          self.board,
-                                          pawn_promotion=pawn_promotion))
-                    elif (row+1, col-1) == self.enpassant:
-                        moves.append(Move((row, col),
-                                          (row+1, col-1),
-                                          self.board,
-                                          enpassant=True))
-            if col+1 <= 7:
-                if not piece_pinned or pin_direction == (1, 1):
-                    if self.board[row+1][col+1][0] == 'w':
-                        moves.append(Move((row, col),
-                                          (row+1, col+1),
-                                          self.board,
-                                          pawn_promotion=pawn_promotion))
-                    elif (row+1, col+1) == self.enpassant:
-                        moves.append(Move((row, col),
-                                          (row+1, col+1),
-                                          self.board,
-                                          enpassant=True))
-
-    def get_rook_moves(self, row, col, moves):
-        piece_pinned, pin_direction = self.check_pinned(row, col, rook=True)
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemy_color = 'b' if self.white_move else 'w'
-
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    if not piece_pinned or pin_direction == d or \
-                            pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == '--':
-                            moves.append(Move((row, col),
-                                              (end_row, end_col),
-                                              self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(Move((row, col),
-                                              (end_row, end_col),
-                                              self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
-
-    def get_knight_moves(self, row, col, moves):
-        piece_pinned, _ = self.check_pinned(row, col)
+            forward, last_row, start_row, enemy = 1, 7, 1, \
+                self.occupancy['w']
+
+        end = square + 8 * forward
+        pawn_promotion = True if row + forward == last_row else False
+
+        if not self.occupied & (1 << end):
+            if not piece_pinned or pin_direction == (forward, 0):
+                if targets & (1 << end):
+                    self.add_move(square, end, moves,
+                                  pawn_promotion=pawn_promotion)
+                if row == start_row and \
+                        targets & ~self.occupied & (1 << (end + 8 * forward)):
+                    self.add_move(square, end + 8 * forward, moves)
+        for d in (-1, 1):
+            if 0 <= col + d <= 7:
+                if not piece_pinned or pin_direction == (forward, d):
+                    if targets & enemy & (1 << (end + d)):
+                        self.add_move(square, end + d, moves,
+                                      pawn_promotion=pawn_promotion)
+
+    def get_enpassant_moves(self, moves):
+        # en passant is tested by making it on the occupancy and looking for
+        # attacks on the king, which covers pins along the rank that take
+        # both pawns off it as well as captures of a pawn giving check
+        if self.enpassant == ():
+            return
 
-        directions = ((-2, -1), (-2, 1), (2, -1), (2, 1),
-                      (-1, -2), (-1, 2), (1, -2), (1, 2))
-        ally_color = 'w' if self.white_move else 'b'
-
-        for d in directions:
-            end_row = row + d[0]
-            end_col = col + d[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:
-                        moves.append(Move((row, col),
-                                          (end_row, end_col),
-                                          self.board))
-
-    def get_bishop_moves(self, row, col, moves):
+        ally_color, enemy_color = ('w', 'b') if self.white_move else \
+            ('b', 'w')
+        end = self.enpassant[0] * 8 + self.enpassant[1]
+        captured = end + (8 if self.white_move else -8)
+        king_row, king_col = self.white_king if self.white_move else \
+            self.black_king
+        king = king_row * 8 + king_col
+
+        pawns = PAWN_ATTACKS[enemy_color][end] & \
+            self.bitboards[ally_color + 'p']
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            occupied = self.occupied ^ bit ^ (1 << captured) | (1 << end)
+            if not self.get_attackers(king, enemy_color, occupied) & \
+                    ~(1 << captured):
+                self.add_move(bit.bit_length() - 1, end, moves,
+                              enpassant=True)
+
+    def get_sliding_moves(self, row, col, moves, directions,
+                          targets=ALL_SQUARES):
         piece_pinned, pin_direction = self.check_pinned(row, col)
 
-        directions = ((1, 1), (1, -1), (-1, 1), (-1, -1))
-        enemy_color = 'b' if self.white_move else 'w'
+        square = row * 8 + col
+        attacks = 0
 
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    if not piece_pinned or pin_direction == d or \
-                            pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == '--':
-                            moves.append(Move((row, col),
-                                              (end_row, end_col),
-                                              self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(Move((row, col),
-                                              (end_row, end_col),
-                                              self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
+        for j in directions:
+            d = DIRECTIONS[j]
+            if piece_pinned and pin_direction != d and \
+                    pin_direction != (-d[0], -d[1]):
+                continue
+            attacks |= get_ray_attacks(j, square, self.occupied)
 
-    def get_queen_moves(self, row, col, moves):
-        self.get_rook_moves(row, col, moves)
-        self.get_bishop_moves(row, col, moves)
-
-    def get_king_moves(self, row, col, moves):
-        directions = ((-1, -1), (-1, 0), (-1, 1),
-                      (0, -1), (0, 1),
-                      (1, -1), (1, 0), (1, 1))
-        ally_color = 'w' if self.white_move else 'b'
-
-        for d in directions:
-            end_row = row + d[0]
-            end_col = col + d[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    if ally_color == 'w':
-                        self.white_king = (end_row, end_col)
-                    else:
-                        self.black_king = (end_row, end_col)
-                    in_check, pins, checks = self.get_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((row, col),
-                                          (end_row, end_col),
-                                          self.board))
-                    if ally_color == 'w':
-                        self.white_king = (row, col)
-                    else:
-                        self.black_king = (row, col)
+        self.add_moves(square, attacks & targets &
+                       ~self.occupancy['w' if self.white_move else 'b'],
+                       moves)
+
+    def get_rook_moves(self, row, col, moves, targets=ALL_SQUARES):
+        self.get_sliding_moves(row, col, moves, (0, 1, 2, 3), targets)
+
+    def get_knight_moves(self, row, col, moves, targets=ALL_SQUARES):
+        piece_pinned, _ = self.check_pinned(row, col)
+
+        if piece_pinned:
+            return
+
+        square = row * 8 + col
+        self.add_moves(square, KNIGHT_ATTACKS[square] & targets &
+                       ~self.occupancy['w' if self.white_move else 'b'],
+                       moves)
+
+    def get_bishop_moves(self, row, col, moves, targets=ALL_SQUARES):
+        self.get_sliding_moves(row, col, moves, (4, 5, 6, 7), targets)
+
+    def get_queen_moves(self, row, col, moves, targets=ALL_SQUARES):
+        self.get_sliding_moves(row, col, moves, (0, 1, 2, 3, 4, 5, 6, 7),
+                               targets)
+
+    def get_king_moves(self, row, col, moves, targets=ALL_SQUARES):
+        ally_color, enemy_color = ('w', 'b') if self.white_move else \
+            ('b', 'w')
+        square = row * 8 + col
+        # take the king off so it can't hide behind itself on a slider's ray
+        occupied = self.occupied ^ (1 << square)
+
+        targets &= KING_ATTACKS[square] & ~self.occupancy[ally_color]
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            if not self.get_attackers(end, enemy_color, occupied):
+                self.add_move(square, end, moves)
 
     def get_castling_moves(self, moves):
         if self.in_check:
@@ -700,43 +967,34 @@ class GameState:
                 self.get_queenside_castling_moves(0, 4, moves)
 
     def get_kingside_castling_moves(self, row, col, moves):
-        if self.board[row][col+1] == '--' and self.board[row][col+2] == '--':
+        square = row * 8 + col
+        if not self.occupied & (0b11 << (square + 1)):
             if not self.square_under_attack(row, col+1) and not \
                     self.square_under_attack(row, col+2):
-                moves.append(Move((row, col), (row, col+2), self.board,
-                                  castling=True))
+                self.add_move(square, square + 2, moves, castling=True)
 
     def get_queenside_castling_moves(self, row, col, moves):
-        if self.board[row][col-1] == '--' and self.board[row][col-2] == '--'\
-                and self.board[row][col-3] == '--':
+        square = row * 8 + col
+        if not self.occupied & (0b111 << (square - 3)):
             if not self.square_under_attack(row, col-1) and not \
                     self.square_under_attack(row, col-2):
-                moves.append(Move((row, col), (row, col-2), self.board,
-                                  castling=True))
+                self.add_move(square, square - 2, moves, castling=True)
 
     def square_under_attack(self, row, col):
-        self.white_move = not self.white_move
-
-        opp_moves = self.get_all_moves()
-
-        self.white_move = not self.white_move
-
-        for move in opp_moves:
-            if move.end_row == row and move.end_col == col:
-                return True
-
-        return False
+        return self.get_attackers(row * 8 + col,
+                                  'b' if self.white_move else 'w',
+                                  self.occupied) != 0
 
     def get_pieces_taken(self):
+        # full recount, only needed when a whole board is set up
         self.white_has = []
         self.black_has = []
 
-        for row in self.board:
-            for piece in row:
-                if piece[0] == 'w':
-                    self.white_has.append(piece[1])
-                elif piece[0] == 'b':
-                    self.black_has.append(piece[1])
+        for piece in self.squares:
+            if piece[0] == 'w':
+                self.white_has.append(piece[1])
+            elif piece[0] == 'b':
+                self.black_has.append(piece[1])
 
         self.white_taken = list((self.all_board_pieces_counter - Counter(
             self.black_has)).elements())
@@ -759,52 +1017,124 @@ class GameState:
         self.white_taken = ['b' + element for element in self.white_taken]
         self.black_taken = ['w' + element for element in self.black_taken]
 
-        self.white_score = sum([self.piece_scores[piece[1]] for piece in
-                                self.white_taken])
+        self.white_taken.sort(key=lambda x: self.pieces_order[x[1]])
+        self.black_taken.sort(key=lambda x: self.pieces_order[x[1]])
+
+        self.material = {'w': 0, 'b': 0}
+        for piece in PIECES:
+            self.material[piece[0]] += self.piece_scores[piece[1]] * \
+                self.bitboards[piece].bit_count()
 
-        self.black_score = sum([self.piece_scores[piece[1]] for piece in
-                                self.black_taken])
+        self.update_scores()
 
-        if self.white_score > self.black_score:
-            self.white_score -= self.black_score
-            self.black_score = 0
-        elif self.white_score < self.black_score:
-            self.black_score -= self.white_score
-            self.white_score = 0
-        else:
-            self.white_score = 0
-            self.black_score = 0
+    def update_pieces_taken(self, move, captured):
+        if captured != EMPTY:
+            if captured[0] == 'b':
+                self.black_has.remove(captured[1])
+                insort(self.white_taken, captured,
+                       key=lambda x: self.pieces_order[x[1]])
+            else:
+                self.white_has.remove(captured[1])
+                insort(self.black_taken, captured,
+                       key=lambda x: self.pieces_order[x[1]])
+            self.material[captured[0]] -= self.piece_scores[captured[1]]
 
+        if move.is_pawn_promotion:
+            has = self.white_has if move.piece_moved[0] == 'w' else \
+                self.black_has
+            has.remove('p')
+            has.append(move.promotion)
+            self.material[move.piece_moved[0]] += \
+                self.piece_scores[move.promotion] - self.piece_scores['p']
+
+        self.update_scores()
+
+    def revert_pieces_taken(self, move, captured):
+        if captured != EMPTY:
+            if captured[0] == 'b':
+                self.black_has.append(captured[1])
+                self.white_taken.remove(captured)
+            else:
+                self.white_has.append(captured[1])
+                self.black_taken.remove(captured)
+            self.material[captured[0]] += self.piece_scores[captured[1]]
 
-        self.white_taken.sort(key=lambda x: self.pieces_order[x[1]])
-        self.black_taken.sort(key=lambda x: self.pieces_order[x[1]])
+        if move.is_pawn_promotion:
+            has = self.white_has if move.piece_moved[0] == 'w' else \
+                self.black_has
+            has.remove(move.promotion)
+            has.append('p')
+            self.material[move.piece_moved[0]] -= \
+                self.piece_scores[move.promotion] - self.piece_scores['p']
+
+        self.update_scores()
+
+    def update_scores(self):
+        difference = self.material['w'] - self.material['b']
+        self.white_score = max(difference, 0)
+        self.black_score = max(-difference, 0)
+
+    def is_insufficient_material(self):
+        bitboards = self.bitboards
+
+        if bitboards['wp'] | bitboards['bp'] | bitboards['wr'] | \
+                bitboards['br'] | bitboards['wq'] | bitboards['bq']:
+            return False
+
+        knights = bitboards['wn'] | bitboards['bn']
+        bishops = bitboards['wb'] | bitboards['bb']
+
+        # a single minor piece, or only bishops that all stand on the same
+        # colour squares, can never deliver mate
+        if (knights | bishops).bit_count() <= 1:
+            return True
+
+        return not knights and (not bishops & LIGHT_SQUARES or
+                                not bishops & ~LIGHT_SQUARES)
 
 
 class Move:
+    # slots keep the many moves held in valid_move_log small, and the
+    # notation slots are only filled in for moves that are actually played
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col',
+                 'piece_moved', 'piece_captured',
+                 'is_pawn_promotion', 'is_enpassant', 'is_castling',
+                 'promotion', 'move_id',
+                 'is_capture', 'is_check', 'is_checkmate', 'is_stalemate',
+                 'is_three_fold', 'is_fifty_rule', 'is_impossibility',
+                 'simple_notation', 'chess_notation')
+
     def __init__(self, start_sq, end_sq, board,
-                 pawn_promotion=False, enpassant=False, castling=False):
+                 pawn_promotion=False, enpassant=False, castling=False,
+                 piece_moved=None, piece_captured=None, promotion='q'):
         self.start_row, self.start_col = start_sq
         self.end_row, self.end_col = end_sq
 
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+        # the engine passes the pieces straight from its squares so that it
+        # never has to build the 8x8 board
+        if piece_moved is None:
+            self.piece_moved = board[self.start_row][self.start_col]
+            self.piece_captured = board[self.end_row][self.end_col]
+        else:
+            self.piece_moved = piece_moved
+            self.piece_captured = piece_captured
 
         self.is_pawn_promotion = pawn_promotion #self.check_pawn_promotion()
         self.is_enpassant = enpassant #self.check_enpassant(possible_enpassant)
         self.is_castling = castling
+        self.promotion = promotion
 
         if self.is_enpassant:
             self.piece_captured = 'wp' if self.piece_moved == 'bp' else 'bp'
 
-        self.move_id = str(self.start_row) + \
-            str(self.start_col) + \
-            str(self.end_row) + \
-            str(self.end_col)
-
-        self.reverse_id = str(self.end_row) + \
-            str(self.end_col) + \
-            str(self.start_row) + \
-            str(self.start_col)
+        # start square in the low 6 bits, end square in the next 6 and the
+        # promotion piece above them, with a queen as 0 so a move made on the
+        # board without choosing a piece matches the queen promotion, the en
+        # passant and castling flags follow from these and the position
+        self.move_id = self.start_row * 8 + self.start_col | \
+            (self.end_row * 8 + self.end_col) << 6
+        if pawn_promotion:
+            self.move_id |= PROMOTIONS.index(promotion) << 12
 
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -812,11 +1142,14 @@ class Move:
 
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     def __str__(self):
         if self.is_castling:
             return "O-O" if self.end_col == 6 else "O-O-O"
 
-        end_square = self.get_rank_file(self.end_row, self.end_col)
+        end_square = get_rank_file(self.end_row, self.end_col)
 
         # TODO:
         # add in check if there are ambiguities between which piece was moved
@@ -827,12 +1160,12 @@ class Move:
 
         if self.piece_moved[1] == 'p':
             if self.is_capture:
-                move_string += self.cols_to_files[self.start_col] + 'x'
+                move_string += COLS_TO_FILES[self.start_col] + 'x'
 
             move_string += end_square
 
             if self.is_pawn_promotion:
-                move_string += '=Q'
+                move_string += '=' + self.promotion.upper()
 
         else:
             move_string += self.piece_moved[1].capitalize()
@@ -858,27 +1191,150 @@ class Move:
         self.is_fifty_rule = None
         self.is_impossibility = None
 
-        self.ranks_to_rows = {'1': 7, '2': 6, '3': 5, '4': 4,
-                              '5': 3, '6': 2, '7': 1, '8': 0}
-        self.rows_to_ranks = {v: k for k, v in self.ranks_to_rows.items()}
-
-        self.files_to_cols = {'a': 0, 'b': 1, 'c': 2, 'd': 3,
-                              'e': 4, 'f': 5, 'g': 6, 'h': 7}
-        self.cols_to_files = {v: k for k, v in self.files_to_cols.items()}
-
         self.simple_notation = self.get_simple_notation()
         self.chess_notation = self.__str__()
 
     def get_simple_notation(self):
-        return self.get_rank_file(self.start_row, self.start_col) + \
-               self.get_rank_file(self.end_row, self.end_col)
+        return get_rank_file(self.start_row, self.start_col) + \
+               get_rank_file(self.end_row, self.end_col) + \
+               (self.promotion if self.is_pawn_promotion else '')
+
+
+RANKS_TO_ROWS = {'1': 7, '2': 6, '3': 5, '4': 4,
+                 '5': 3, '6': 2, '7': 1, '8': 0}
+ROWS_TO_RANKS = {v: k for k, v in RANKS_TO_ROWS.items()}
+
+FILES_TO_COLS = {'a': 0, 'b': 1, 'c': 2, 'd': 3,
+                 'e': 4, 'f': 5, 'g': 6, 'h': 7}
+COLS_TO_FILES = {v: k for k, v in FILES_TO_COLS.items()}
+
+
+def get_rank_file(row, col):
+    return COLS_TO_FILES[col] + ROWS_TO_RANKS[row]
+
+
+def get_board_fen(squares):
+    # the first field of a fen, the squares a8 first and h1 last
+    ranks = []
+    for row in range(8):
+        rank = ''
+        empty = 0
+        for piece in squares[row * 8:row * 8 + 8]:
+            if piece == EMPTY:
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece[1].upper() if piece[0] == 'w' else piece[1]
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+
+    return '/'.join(ranks)
+
+
+def get_signed_tables(piece_square_tables):
+    # one table per piece rather than per piece type, flipped for black and
+    # negated so black's pieces count against white
+    tables = []
+
+    for stage in ('mg', 'eg'):
+        tables.append({piece: [piece_square_tables[stage][piece[1]][square]
+                               if piece[0] == 'w' else
+                               -piece_square_tables[stage][piece[1]][
+                                   square ^ 56]
+                               for square in range(64)]
+                       for piece in PIECES})
+
+    return tables
+
+
+def get_row_col(bitboard):
+    square = (bitboard & -bitboard).bit_length() - 1
+
+    return square >> 3, square & 7
+
+
+def get_step_attacks(steps):
+    attacks = []
+
+    for square in range(64):
+        row, col = square >> 3, square & 7
+        bitboard = 0
+        for d in steps:
+            if 0 <= row + d[0] <= 7 and 0 <= col + d[1] <= 7:
+                bitboard |= 1 << ((row + d[0]) * 8 + col + d[1])
+        attacks.append(bitboard)
+
+    return attacks
+
+
+def get_rays(d):
+    # every square from each square to the edge of the board along d,
+    # not including the square itself
+    rays = []
+
+    for square in range(64):
+        row, col = (square >> 3) + d[0], (square & 7) + d[1]
+        bitboard = 0
+        while 0 <= row <= 7 and 0 <= col <= 7:
+            bitboard |= 1 << (row * 8 + col)
+            row += d[0]
+            col += d[1]
+        rays.append(bitboard)
+
+    return rays
+
+
+def get_ray_attacks(j, square, occupied):
+    # the ray up to and including the first piece on it
+    ray = RAYS[j][square]
+    blockers = ray & occupied
+
+    if blockers:
+        if j in POSITIVE_DIRECTIONS:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= RAYS[j][blocker]
+
+    return ray
+
+
+def get_rook_attacks(square, occupied):
+    return get_ray_attacks(0, square, occupied) | \
+        get_ray_attacks(1, square, occupied) | \
+        get_ray_attacks(2, square, occupied) | \
+        get_ray_attacks(3, square, occupied)
+
+
+def get_bishop_attacks(square, occupied):
+    return get_ray_attacks(4, square, occupied) | \
+        get_ray_attacks(5, square, occupied) | \
+        get_ray_attacks(6, square, occupied) | \
+        get_ray_attacks(7, square, occupied)
 
-    def get_rank_file(self, row, col):
-        return self.cols_to_files[col] + self.rows_to_ranks[row]
 
+# rook directions first, then bishop directions
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1),
+              (-1, -1), (-1, 1), (1, -1), (1, 1))
 
+# directions that go towards higher squares, where the nearest piece on a
+# ray is its lowest set bit rather than its highest
+POSITIVE_DIRECTIONS = (2, 3, 6, 7)
 
+RAYS = [get_rays(d) for d in DIRECTIONS]
 
+KNIGHT_ATTACKS = get_step_attacks(((-2, -1), (-2, 1), (2, -1), (2, 1),
+                                   (-1, -2), (-1, 2), (1, -2), (1, 2)))
 
+KING_ATTACKS = get_step_attacks(DIRECTIONS)
 
+# a8 is a light square
+LIGHT_SQUARES = sum(1 << square for square in range(64)
+                    if ((square >> 3) + (square & 7)) % 2 == 0)
 
+# squares attacked by a pawn of each colour standing on a square
+PAWN_ATTACKS = {'w': get_step_attacks(((-1, -1), (-1, 1))),
+                'b': get_step_attacks(((1, -1), (1, 1)))}
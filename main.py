@@ -38,6 +38,8 @@ def single_game(game_type, color='white'):
 
         client.update_display()
 
+    prog.searcher.close()
+
 
 def double_game(game_type):
     pass
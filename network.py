@@ -1,7 +1,8 @@
-import pickle
 #import json
 import socket
 
+import protocol
+
 
 class Network:
     def __init__(self):
@@ -9,6 +10,11 @@ class Network:
         self.server = "192.168.0.11"
         self.port = 5555
         self.addr = (self.server, self.port)
+
+        # the sequence number of the last state had from the server, None
+        # until the first, which is sent whole
+        self.sequence = None
+
         self.player = self.connect()
 
         self.connected = True if self.player is not None else False
@@ -19,16 +25,42 @@ class Network:
     def connect(self):
         try:
             self.client.connect(self.addr)
+            self.reader = protocol.MessageReader(self.client)
             #return self.client.recv(2048).decode()
             #return pickle.loads(self.client.recv(4096))
-            return json.loads(self.client.recv(2048))
+            #return json.loads(self.client.recv(2048))
+            return protocol.decode(self.reader.read())[1]
         except:
             return None
 
+    def get_game_state(self, game_state=None):
+        return self.sync(protocol.encode_get(self.sequence), game_state)
+
+    def send_move(self, move_id, game_state):
+        return self.sync(protocol.encode_move(self.sequence, move_id),
+                         game_state)
+
+    def sync(self, data, game_state):
+        # the game as the server has it, either sent whole or as the moves
+        # since the last state made on game_state
+        reply = self.send(data)
+        if reply is None:
+            raise ConnectionError('No reply from the server.')
+
+        message_type, (self.sequence, body) = reply
+
+        if message_type == protocol.STATE:
+            return body
+
+        protocol.apply_delta(game_state, body)
+
+        return game_state
+
     def send(self, data):
         try:
             #self.client.send(str.encode(data))
-            self.client.send(pickle.dumps(data))
+            #self.client.send(pickle.dumps(data))
+            self.client.sendall(protocol.frame(data))
             #self.client.send(json.dumps(data))
 
             '''
@@ -44,7 +76,8 @@ class Network:
             return new_data_arr
             '''
 
-            return pickle.loads(self.client.recv(1048576))
+            #return pickle.loads(self.client.recv(1048576))
+            return protocol.decode(self.reader.read())
             #return json.loads(self.client.recv(2048))
 
         except socket.error as e:
@@ -0,0 +1,119 @@
+import argparse
+from time import time
+
+import engine
+
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# the standard perft positions with their leaf counts from depth 1 upwards,
+# between them they cover castling, en passant, promotions, pins and checks
+POSITIONS = {
+    'start': (START_FEN,
+              [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R '
+                 'w KQkq - 0 1',
+                 [48, 2039, 97862, 4085603]),
+    'position_3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                   [14, 191, 2812, 43238, 674624]),
+    'position_4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 '
+                   'w kq - 0 1',
+                   [6, 264, 9467, 422333]),
+    'position_4_mirrored': ('r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/'
+                            'pPPP1PPP/R3K2R b KQ - 0 1',
+                            [6, 264, 9467, 422333]),
+    'position_5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R '
+                   'w KQ - 1 8',
+                   [44, 1486, 62379, 2103487]),
+    'position_6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/'
+                   '1PP1QPPP/R4RK1 w - - 0 10',
+                   [46, 2079, 89890, 3894594]),
+}
+
+
+def perft(game_state, depth):
+    if depth == 0:
+        return 1
+
+    moves = game_state.get_valid_moves(return_moves=True)
+
+    # bulk count the last ply rather than making every move
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+
+    for move in moves:
+        game_state.make_move(move, quick=True)
+        nodes += perft(game_state, depth - 1)
+        game_state.undo_move(quick=True)
+
+    return nodes
+
+
+def divide(game_state, depth):
+    counts = {}
+
+    for move in game_state.get_valid_moves(return_moves=True):
+        game_state.make_move(move, quick=True)
+        counts[move.get_simple_notation()] = perft(game_state, depth - 1)
+        game_state.undo_move(quick=True)
+
+    return counts
+
+
+def run(fen, depth, show_divide=False):
+    game_state = engine.GameState(fen=fen)
+
+    start = time()
+
+    if show_divide:
+        counts = divide(game_state, depth)
+        for notation in sorted(counts):
+            print('{}: {}'.format(notation, counts[notation]))
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(game_state, depth)
+
+    time_taken = max(time() - start, 1e-9)
+
+    print('depth {}: {} nodes in {:.2f}s ({:.0f} nodes/s)'.format(
+        depth, nodes, time_taken, nodes / time_taken))
+
+    return nodes
+
+
+def run_suite(max_depth):
+    failures = []
+
+    for name, (fen, counts) in POSITIONS.items():
+        for depth, expected in enumerate(counts[:max_depth], start=1):
+            print(name, end=' ')
+            nodes = run(fen, depth)
+            if nodes != expected:
+                print('  expected {}'.format(expected))
+                failures.append((name, depth, nodes, expected))
+
+    if failures:
+        print('{} perft counts wrong'.format(len(failures)))
+    else:
+        print('All perft counts correct')
+
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Count move generator leaf nodes to a given depth.')
+    parser.add_argument('depth', type=int, nargs='?', default=3)
+    parser.add_argument('--fen', default=START_FEN)
+    parser.add_argument('--divide', action='store_true',
+                        help='show the count below each root move')
+    parser.add_argument('--suite', action='store_true',
+                        help='check the reference positions up to depth')
+    args = parser.parse_args()
+
+    if args.suite:
+        exit(1 if run_suite(args.depth) else 0)
+    else:
+        run(args.fen, args.depth, args.divide)
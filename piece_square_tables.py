@@ -0,0 +1,91 @@
+# bonuses in hundredths of a pawn for a piece standing on each square, laid
+# out as the board is drawn from white's side so a8 comes first, black uses
+# the same tables with the rows flipped
+
+PAWN_MIDDLEGAME = [0, 0, 0, 0, 0, 0, 0, 0,
+                   50, 50, 50, 50, 50, 50, 50, 50,
+                   10, 10, 20, 30, 30, 20, 10, 10,
+                   5, 5, 10, 25, 25, 10, 5, 5,
+                   0, 0, 0, 20, 20, 0, 0, 0,
+                   5, -5, -10, 0, 0, -10, -5, 5,
+                   5, 10, 10, -20, -20, 10, 10, 5,
+                   0, 0, 0, 0, 0, 0, 0, 0]
+
+# in the endgame a pawn is worth more the closer it is to promoting
+PAWN_ENDGAME = [0, 0, 0, 0, 0, 0, 0, 0,
+                80, 80, 80, 80, 80, 80, 80, 80,
+                50, 50, 50, 50, 50, 50, 50, 50,
+                30, 30, 30, 30, 30, 30, 30, 30,
+                20, 20, 20, 20, 20, 20, 20, 20,
+                10, 10, 10, 10, 10, 10, 10, 10,
+                10, 10, 10, 10, 10, 10, 10, 10,
+                0, 0, 0, 0, 0, 0, 0, 0]
+
+KNIGHT = [-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20, 0, 0, 0, 0, -20, -40,
+          -30, 0, 10, 15, 15, 10, 0, -30,
+          -30, 5, 15, 20, 20, 15, 5, -30,
+          -30, 0, 15, 20, 20, 15, 0, -30,
+          -30, 5, 10, 15, 15, 10, 5, -30,
+          -40, -20, 0, 5, 5, 0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50]
+
+BISHOP = [-20, -10, -10, -10, -10, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 10, 10, 5, 0, -10,
+          -10, 5, 5, 10, 10, 5, 5, -10,
+          -10, 0, 10, 10, 10, 10, 0, -10,
+          -10, 10, 10, 10, 10, 10, 10, -10,
+          -10, 5, 0, 0, 0, 0, 5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20]
+
+ROOK = [0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0]
+
+QUEEN = [-20, -10, -10, -5, -5, -10, -10, -20,
+         -10, 0, 0, 0, 0, 0, 0, -10,
+         -10, 0, 5, 5, 5, 5, 0, -10,
+         -5, 0, 5, 5, 5, 5, 0, -5,
+         0, 0, 5, 5, 5, 5, 0, -5,
+         -10, 5, 5, 5, 5, 5, 0, -10,
+         -10, 0, 5, 0, 0, 0, 0, -10,
+         -20, -10, -10, -5, -5, -10, -10, -20]
+
+# the king hides behind its pawns while there are pieces to attack it, and
+# comes to the centre once they are gone
+KING_MIDDLEGAME = [-30, -40, -40, -50, -50, -40, -40, -30,
+                   -30, -40, -40, -50, -50, -40, -40, -30,
+                   -30, -40, -40, -50, -50, -40, -40, -30,
+                   -30, -40, -40, -50, -50, -40, -40, -30,
+                   -20, -30, -30, -40, -40, -30, -30, -20,
+                   -10, -20, -20, -20, -20, -20, -20, -10,
+                   20, 20, 0, 0, 0, 0, 20, 20,
+                   20, 30, 10, 0, 0, 10, 30, 20]
+
+KING_ENDGAME = [-50, -40, -30, -20, -20, -30, -40, -50,
+                -30, -20, -10, 0, 0, -10, -20, -30,
+                -30, -10, 20, 30, 30, 20, -10, -30,
+                -30, -10, 30, 40, 40, 30, -10, -30,
+                -30, -10, 30, 40, 40, 30, -10, -30,
+                -30, -10, 20, 30, 30, 20, -10, -30,
+                -30, -30, 0, 0, 0, 0, -30, -30,
+                -50, -30, -30, -30, -30, -30, -30, -50]
+
+PIECE_SQUARE_TABLES = {
+    'mg': {'p': PAWN_MIDDLEGAME, 'n': KNIGHT, 'b': BISHOP,
+           'r': ROOK, 'q': QUEEN, 'k': KING_MIDDLEGAME},
+    'eg': {'p': PAWN_ENDGAME, 'n': KNIGHT, 'b': BISHOP,
+           'r': ROOK, 'q': QUEEN, 'k': KING_ENDGAME},
+}
+
+# how far from the endgame each piece left on the board makes the position,
+# all of them together at the start make MAX_PHASE
+PHASES = {'k': 0, 'q': 4, 'r': 2, 'b': 1, 'n': 1, 'p': 0}
+
+MAX_PHASE = 24
@@ -0,0 +1,363 @@
+import struct
+
+import engine
+
+
+# bumped whenever a message changes, a message from any other version is
+# refused rather than misread
+VERSION = 2
+
+# every message starts with the version and one of these
+HELLO = 0
+GET = 1
+MOVE = 2
+STATE = 3
+DELTA = 4
+
+HEADER = struct.Struct('>BB')
+
+# every message goes out with its length in front so that it can be read
+# back whole however the stream splits it, and a length over the limit is
+# taken as a broken connection rather than allocated
+FRAME_HEADER = struct.Struct('>I')
+MAX_MESSAGE_SIZE = 2**16
+
+PLAYER = struct.Struct('>B')
+
+# a client asks with the sequence number of the last state it has, and a
+# move also has the move id
+SEQUENCE = struct.Struct('>I')
+SEQUENCE_MOVE = struct.Struct('>IH')
+
+# the sequence number, squares as one nibble each, game type, side to move,
+# castling, en passant, halfmove clock, result flags, both clocks, the last
+# move with its flags and the piece it took, and then how many legal moves
+# follow as move ids
+STATE_HEADER = struct.Struct('>I32sBBBBHBffHBBH')
+
+# the sequence number, side to move, result flags, both clocks and then how
+# many of the moves made since the client's state follow as move ids
+DELTA_HEADER = struct.Struct('>IBBffH')
+
+GAME_TYPES = ('rapid', 'blitz', 'bullet', 'standard')
+CASTLING = ('wk', 'wq', 'bk', 'bq')
+
+# the flags of the game and then its results, one bit each
+GAME_FLAGS = ('white_move', 'ready', 'game_started')
+RESULT_FLAGS = ('game_over', 'timeout', 'checkmate', 'stalemate',
+                'is_three_fold', 'is_fifty_rule', 'is_impossibility')
+
+MOVE_FLAGS = ('is_pawn_promotion', 'is_enpassant', 'is_castling',
+              'is_check', 'is_checkmate')
+
+# the messages a client sends, the server reads nothing else
+REQUESTS = (GET, MOVE)
+
+# the last move id when no move has been made
+NO_MOVE = 0xFFFF
+NO_ENPASSANT = 0xFF
+
+# sent by a client that has no state yet
+NO_SEQUENCE = 0xFFFFFFFF
+
+
+def frame(message):
+    return FRAME_HEADER.pack(len(message)) + message
+
+
+def get_message_size(header):
+    size = FRAME_HEADER.unpack_from(header)[0]
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError('Message of {} bytes is over the limit of {}.'.format(
+            size, MAX_MESSAGE_SIZE))
+
+    return size
+
+
+class MessageReader:
+    # reads messages off a blocking socket straight into one buffer made up
+    # front, so a message split over many packets is never put together by
+    # concatenation, and whatever arrives after a message is kept for the
+    # next one
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray(FRAME_HEADER.size + MAX_MESSAGE_SIZE)
+        self.view = memoryview(self.buffer)
+
+        # the bytes received but not yet read
+        self.start = 0
+        self.end = 0
+
+    def receive(self):
+        # move what is left to the front once the end of the buffer is near
+        if self.end == len(self.buffer) or \
+                self.start > len(self.buffer) // 2:
+            self.buffer[:self.end - self.start] = \
+                self.buffer[self.start:self.end]
+            self.end -= self.start
+            self.start = 0
+
+        received = self.sock.recv_into(self.view[self.end:])
+        if not received:
+            raise ConnectionError('Connection closed.')
+
+        self.end += received
+
+    def read(self):
+        # the next message, which is only good until the next read
+        while self.end - self.start < FRAME_HEADER.size:
+            self.receive()
+
+        size = get_message_size(self.view[self.start:])
+        start = self.start + FRAME_HEADER.size
+
+        while self.end - self.start < FRAME_HEADER.size + size:
+            self.receive()
+            start = self.start + FRAME_HEADER.size
+
+        self.start = start + size
+
+        return self.view[start:self.start]
+
+
+async def read_message(reader):
+    # the asyncio streams buffer what they read themselves, so only the
+    # length and its limit are needed
+    size = get_message_size(await reader.readexactly(FRAME_HEADER.size))
+
+    return await reader.readexactly(size)
+
+
+def get_sequence(game_state):
+    # the version of a game, every move made bumps it
+    return len(game_state.move_log)
+
+
+def get_header(message_type):
+    return HEADER.pack(VERSION, message_type)
+
+
+def get_flags(obj, names):
+    flags = 0
+    for i, name in enumerate(names):
+        if getattr(obj, name):
+            flags |= 1 << i
+
+    return flags
+
+
+def set_flags(obj, names, flags):
+    for i, name in enumerate(names):
+        setattr(obj, name, bool(flags >> i & 1))
+
+
+def encode_hello(player):
+    return get_header(HELLO) + PLAYER.pack(player)
+
+
+def encode_get(sequence=None):
+    return get_header(GET) + SEQUENCE.pack(
+        NO_SEQUENCE if sequence is None else sequence)
+
+
+def encode_move(sequence, move_id):
+    return get_header(MOVE) + SEQUENCE_MOVE.pack(
+        NO_SEQUENCE if sequence is None else sequence, move_id)
+
+
+def encode_reply(game_state, sequence):
+    # only what has changed since the client's state, unless it has none or
+    # it isn't of this game
+    if sequence is None or sequence > get_sequence(game_state):
+        return encode_state(game_state)
+
+    return encode_delta(game_state, sequence)
+
+
+def encode_squares(squares):
+    codes = [engine.PIECE_CODES[piece] for piece in squares]
+
+    return bytes(codes[i] << 4 | codes[i + 1] for i in range(0, 64, 2))
+
+
+def decode_squares(data):
+    squares = []
+    for byte in data:
+        for code in (byte >> 4, byte & 15):
+            if code not in engine.CODES_TO_PIECES:
+                raise ValueError('Unknown piece code {}.'.format(code))
+            squares.append(engine.CODES_TO_PIECES[code])
+
+    return squares
+
+
+def encode_state(game_state):
+    castling = 0
+    for i, side in enumerate(CASTLING):
+        if game_state.castling[side]:
+            castling |= 1 << i
+
+    enpassant = NO_ENPASSANT
+    if game_state.enpassant:
+        enpassant = game_state.enpassant[0] * 8 + game_state.enpassant[1]
+
+    last_move_id = NO_MOVE
+    last_move_flags = 0
+    captured = 0
+    if game_state.move_log:
+        # the moved piece is where the move left it unless it was promoted
+        move = game_state.move_log[-1]
+        last_move_id = move.move_id
+        last_move_flags = get_flags(move, MOVE_FLAGS)
+        captured = engine.PIECE_CODES[move.piece_captured]
+
+    move_ids = [move.move_id for move in game_state.valid_moves]
+
+    return get_header(STATE) + STATE_HEADER.pack(
+        get_sequence(game_state), encode_squares(game_state.squares),
+        GAME_TYPES.index(game_state.game_type),
+        get_flags(game_state, GAME_FLAGS), castling, enpassant,
+        min(game_state.moves_since_pawn_move, game_state.moves_since_capture),
+        get_flags(game_state, RESULT_FLAGS),
+        game_state.white_time or 0.0, game_state.black_time or 0.0,
+        last_move_id, last_move_flags, captured, len(move_ids)) + \
+        struct.pack('>{}H'.format(len(move_ids)), *move_ids)
+
+
+def decode_state(data, game_mode='online'):
+    (sequence, squares, game_type, game_flags, castling, enpassant, halfmoves,
+     result_flags, white_time, black_time, last_move_id, last_move_flags,
+     captured, num_moves) = STATE_HEADER.unpack_from(data)
+    move_ids = struct.unpack_from('>{}H'.format(num_moves), data,
+                                  STATE_HEADER.size)
+
+    squares = decode_squares(squares)
+    game_state = engine.GameState(game_mode=game_mode,
+                                  game_type=GAME_TYPES[game_type])
+
+    game_state.set_position(
+        [squares[row * 8:row * 8 + 8] for row in range(8)],
+        bool(game_flags & 1),
+        {side: bool(castling >> i & 1) for i, side in enumerate(CASTLING)},
+        () if enpassant == NO_ENPASSANT else divmod(enpassant, 8),
+        halfmoves)
+
+    set_flags(game_state, GAME_FLAGS, game_flags)
+    set_flags(game_state, RESULT_FLAGS, result_flags)
+
+    if game_state.timed_game:
+        game_state.white_time = white_time
+        game_state.black_time = black_time
+
+    if last_move_id != NO_MOVE:
+        game_state.move_log.append(get_last_move(squares, last_move_id,
+                                                 last_move_flags, captured))
+
+    # in the order the server has them
+    moves = {move.move_id: move for move in game_state.valid_moves}
+    game_state.valid_moves = [moves[move_id] for move_id in move_ids
+                              if move_id in moves]
+
+    return sequence, game_state
+
+
+def encode_delta(game_state, sequence):
+    move_ids = [move.move_id for move in game_state.move_log[sequence:]]
+
+    return get_header(DELTA) + DELTA_HEADER.pack(
+        get_sequence(game_state), get_flags(game_state, GAME_FLAGS),
+        get_flags(game_state, RESULT_FLAGS),
+        game_state.white_time or 0.0, game_state.black_time or 0.0,
+        len(move_ids)) + struct.pack('>{}H'.format(len(move_ids)), *move_ids)
+
+
+def decode_delta(data):
+    (sequence, game_flags, result_flags, white_time, black_time,
+     num_moves) = DELTA_HEADER.unpack_from(data)
+    move_ids = struct.unpack_from('>{}H'.format(num_moves), data,
+                                  DELTA_HEADER.size)
+
+    return sequence, (move_ids, game_flags, result_flags, white_time,
+                      black_time)
+
+
+def apply_delta(game_state, delta):
+    # make the moves on the client's own copy of the game, so that it keeps
+    # its move log, and then take the clocks and results from the server
+    move_ids, game_flags, result_flags, white_time, black_time = delta
+
+    for move_id in move_ids:
+        for move in game_state.valid_moves:
+            if move.move_id == move_id:
+                game_state.make_move(move)
+                break
+        else:
+            raise ValueError('Move {} is not legal.'.format(move_id))
+
+    set_flags(game_state, GAME_FLAGS, game_flags)
+    set_flags(game_state, RESULT_FLAGS, result_flags)
+
+    if game_state.timed_game:
+        game_state.white_time = white_time
+        game_state.black_time = black_time
+
+
+def get_last_move(squares, move_id, flags, captured):
+    start, end = move_id & 63, move_id >> 6 & 63
+
+    piece_moved = squares[end]
+    if flags & 1:
+        piece_moved = piece_moved[0] + 'p'
+
+    move = engine.Move(divmod(start, 8), divmod(end, 8), None,
+                       pawn_promotion=bool(flags & 1),
+                       enpassant=bool(flags & 2), castling=bool(flags & 4),
+                       piece_moved=piece_moved,
+                       piece_captured=engine.CODES_TO_PIECES[captured],
+                       promotion=engine.PROMOTIONS[move_id >> 12])
+    move.get_extra_info()
+    set_flags(move, MOVE_FLAGS, flags)
+    move.chess_notation = str(move)
+
+    return move
+
+
+def get_message_type(data):
+    version, message_type = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError('Protocol version {} not {}.'.format(version,
+                                                             VERSION))
+
+    return message_type
+
+
+def decode(data):
+    # the type of a message and what it holds
+    message_type = get_message_type(data)
+    body = memoryview(data)[HEADER.size:]
+
+    if message_type == HELLO:
+        return message_type, PLAYER.unpack_from(body)[0]
+    elif message_type == GET:
+        sequence = SEQUENCE.unpack_from(body)[0]
+        return message_type, None if sequence == NO_SEQUENCE else sequence
+    elif message_type == MOVE:
+        sequence, move_id = SEQUENCE_MOVE.unpack_from(body)
+        return message_type, \
+            (None if sequence == NO_SEQUENCE else sequence, move_id)
+    elif message_type == STATE:
+        return message_type, decode_state(body)
+    elif message_type == DELTA:
+        return message_type, decode_delta(body)
+
+    raise ValueError('Unknown message type {}.'.format(message_type))
+
+
+def decode_request(data):
+    # a message from a client, whose type is checked before anything else
+    # is read so that a client can't have the server build a whole game
+    message_type = get_message_type(data)
+    if message_type not in REQUESTS:
+        raise ValueError('Unexpected message type {}.'.format(message_type))
+
+    return decode(data)
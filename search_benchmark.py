@@ -0,0 +1,61 @@
+import argparse
+from multiprocessing import cpu_count
+from time import time
+
+import ai
+import engine
+from perft import POSITIONS
+
+
+# middlegame positions, where the search has the most to do
+BENCHMARK_POSITIONS = ('kiwipete', 'position_4', 'position_5', 'position_6')
+
+
+def time_search(fen, depth, workers):
+    comp = ai.AI()
+    comp.max_depth = depth
+    comp.workers = workers
+
+    # without a clock and with no time limit every search goes to depth
+    comp.untimed_move_time = float('inf')
+    game_state = engine.GameState(game_type='standard', fen=fen)
+
+    searcher = ai.Searcher(comp)
+
+    start = time()
+    move = searcher.find_best_move(game_state)
+    time_taken = time() - start
+
+    searcher.close()
+
+    return move, time_taken
+
+
+def run(depth, worker_counts):
+    serial_time = None
+
+    for workers in worker_counts:
+        total_time = 0
+
+        for name in BENCHMARK_POSITIONS:
+            move, time_taken = time_search(POSITIONS[name][0], depth, workers)
+            total_time += time_taken
+            print('{} workers {}: {} in {:.2f}s'.format(
+                workers, name, move.get_simple_notation(), time_taken))
+
+        if serial_time is None:
+            serial_time = total_time
+
+        print('{} workers: {:.2f}s, {:.2f}x speed-up'.format(
+            workers, total_time, serial_time / total_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time fixed depth searches with more and more workers.')
+    parser.add_argument('depth', type=int, nargs='?', default=4)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, cpu_count()}))
+    args = parser.parse_args()
+
+    run(args.depth, args.workers)
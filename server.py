@@ -1,99 +1,335 @@
+import argparse
+import asyncio
+import heapq
 import socket
+import struct
 import _thread
-import pickle
+from time import time
 #import json
 
 import engine
+import protocol
 
 server = "192.168.0.11"
 port = 5555
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# connections waiting to be accepted, enough that a burst of players joining
+# at once isn't turned away
+backlog = 1024
 
-try:
-    s.bind((server, port))
-except socket.error as e:
-    str(e)
 
-s.listen(2)
-print("Waiting for a connection, Server Started")
+def has_result(game):
+    # a game with a result has stopped clocks
+    return any(getattr(game, name) for name in protocol.RESULT_FLAGS)
+
+
+def get_reply(game, p, data):
+    # apply a message from player p to the game and make the reply
+    message_type, body = protocol.decode_request(data)
+
+    if message_type == protocol.MOVE:
+        sequence, move_id = body
+
+        # only the side to move can move, only a legal move, and not once
+        # the game has a result
+        if game.white_move == (p == 0) and not has_result(game):
+            for move in game.valid_moves:
+                if move.move_id == move_id:
+                    game.make_move(move)
+                    break
+
+    else:
+        sequence = body
+
+    return protocol.encode_reply(game, sequence)
 
 
 def threaded_client(conn, p, game_id):
     global id_count
 
-    #conn.send(str.encode(str(p)))
-    conn.send(pickle.dumps(p))
-    #conn.send(json.dumps(p))
+    # the game goes and its slot is given back however the thread ends, a
+    # connection reset or a bad reply included
+    try:
+        #conn.send(str.encode(str(p)))
+        conn.sendall(protocol.frame(protocol.encode_hello(p)))
+        reader = protocol.MessageReader(conn)
+        #conn.send(json.dumps(p))
 
-    while True:
-        for ID in games:
-            game = games[ID]
+        while True:
+            try:
+                data = reader.read()
+                #data = json.loads(conn.recv(2048))
+                #data = conn.recv(4096).decode()
+                #print('Received: ', data)
+            except:
+                print(20)
+                break
 
-            game.update_timers()
+            if game_id in games:
+                print(games)
+                game = games[game_id]
 
-        try:
-            data = pickle.loads(conn.recv(2048))
-            #data = json.loads(conn.recv(2048))
-            #data = conn.recv(4096).decode()
-            #print('Received: ', data)
-        except:
-            print(20)
-            break
-
-        if game_id in games:
-            print(games)
-            game = games[game_id]
-
-            if not data:
-                print('Disconnected')
-                print(30)
-                break
-            else:
-                #if data == 'reset':
-                #    game = engine.GameState(game_id)
-                #elif data != 'get':
-                if data != 'get':
-                    game.make_move(game.valid_moves[int(data)])
+                if not data:
+                    print('Disconnected')
+                    print(30)
+                    break
+                else:
+                    #if data == 'reset':
+                    #    game = engine.GameState(game_id)
+                    if not has_result(game):
+                        game.update_timers()
 
-            print('Sending : ', game)
-            conn.sendall(pickle.dumps(game))
-            #conn.sendall(json.dumps(game))
+                    try:
+                        reply = get_reply(game, p, data)
+                    except (struct.error, ValueError) as e:
+                        print('Bad message from player {}: {}'.format(p, e))
+                        break
 
-            # conn.sendall(str.encode(reply))
+                print('Sending : ', game)
+                conn.sendall(protocol.frame(reply))
+                #conn.sendall(json.dumps(game))
 
-        else:
-            print(10)
-            break
+                # conn.sendall(str.encode(reply))
 
-    try:
-        del games[game_id]
-    except KeyError:
-        pass
+            else:
+                print(10)
+                break
 
-    id_count -= 1
+    finally:
+        try:
+            del games[game_id]
+        except KeyError:
+            pass
 
-    print('Lost connection')
-    conn.close()
+        id_count -= 1
+
+        print('Lost connection')
+        conn.close()
 
 
 games = {}
 id_count = 0
 
-while True:
-    conn, addr = s.accept()
-    print("Connected to:", addr)
 
-    id_count += 1
-    p = 0
-    game_id = (id_count - 1) // 2
+def run_threaded(host, port):
+    global id_count
 
-    if id_count % 2 == 1:
-        games[game_id] = engine.GameState(ID=game_id,
-                                          game_mode='online',
-                                          game_type='rapid')
-    else:
-        games[game_id].ready = True
-        p = 1
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    try:
+        s.bind((host, port))
+    except socket.error as e:
+        str(e)
+
+    s.listen(2)
+    print("Waiting for a connection, Server Started")
+
+    while True:
+        conn, addr = s.accept()
+        print("Connected to:", addr)
+
+        id_count += 1
+        p = 0
+        game_id = (id_count - 1) // 2
+
+        if id_count % 2 == 1:
+            games[game_id] = engine.GameState(ID=game_id,
+                                              game_mode='online',
+                                              game_type='rapid')
+        else:
+            games[game_id].ready = True
+            p = 1
+
+        _thread.start_new_thread(threaded_client, (conn, p, game_id))
+
+
+class ClockScheduler:
+    # one heap of when the side to move in each game runs out of time, so
+    # a flag falls when it should rather than when someone next sends
+    # something, and nothing has to look at the games whose clocks are fine
+    def __init__(self):
+        self.heap = []
+
+        # the deadline that counts for each game, an entry on the heap for
+        # any other is left over from before a move and skipped
+        self.deadlines = {}
+
+    def schedule(self, game_id, game):
+        # called whenever a move may have changed whose clock is running
+        if not game.timed_game or not game.game_started or \
+                has_result(game):
+            self.cancel(game_id)
+            return
+
+        time_left = game.white_time if game.white_move else game.black_time
+        deadline = game.last_time_stamp + time_left
+
+        self.deadlines[game_id] = deadline
+        heapq.heappush(self.heap, (deadline, game_id))
+
+        # left over entries only go once their deadline passes, so in a busy
+        # server they are cleared out here before they outnumber the rest
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(deadline, game_id)
+                         for game_id, deadline in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, game_id):
+        self.deadlines.pop(game_id, None)
+
+    def get_next_deadline(self):
+        while self.heap and \
+                self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
 
-    _thread.start_new_thread(threaded_client, (conn, p, game_id))
+        return self.heap[0][0] if self.heap else None
+
+    def get_due(self, current_time):
+        # the games whose flag has fallen by now
+        due = []
+
+        while self.heap and self.heap[0][0] <= current_time:
+            deadline, game_id = heapq.heappop(self.heap)
+            if self.deadlines.get(game_id) == deadline:
+                del self.deadlines[game_id]
+                due.append(game_id)
+
+        return due
+
+
+class GameServer:
+    # every connection is a task on the one event loop, so an idle player
+    # costs a socket and a suspended coroutine rather than a thread, and
+    # games is only ever changed between awaits
+    def __init__(self, game_type='rapid'):
+        self.game_type = game_type
+
+        self.games = {}
+
+        # held while a message is applied to a game and its reply is made,
+        # so the two players' moves are never interleaved
+        self.locks = {}
+
+        self.next_game_id = 0
+        self.waiting_game_id = None
+
+        # set when a deadline is scheduled, to wake the clock task in case
+        # it is sooner than the one it is waiting for
+        self.clocks = ClockScheduler()
+        self.clocks_changed = asyncio.Event()
+
+    def join_game(self):
+        # the first player of a pair starts a game and the second readies it
+        if self.waiting_game_id is None:
+            game_id = self.next_game_id
+            self.next_game_id += 1
+
+            self.games[game_id] = engine.GameState(ID=game_id,
+                                                   game_mode='online',
+                                                   game_type=self.game_type)
+            self.locks[game_id] = asyncio.Lock()
+            self.waiting_game_id = game_id
+
+            return game_id, 0
+
+        game_id = self.waiting_game_id
+        self.waiting_game_id = None
+        self.games[game_id].ready = True
+
+        return game_id, 1
+
+    def leave_game(self, game_id):
+        # the game ends with either player leaving it
+        self.games.pop(game_id, None)
+        self.locks.pop(game_id, None)
+        self.clocks.cancel(game_id)
+
+        if self.waiting_game_id == game_id:
+            self.waiting_game_id = None
+
+    async def handle_client(self, reader, writer):
+        game_id, p = self.join_game()
+
+        try:
+            writer.write(protocol.frame(protocol.encode_hello(p)))
+            await writer.drain()
+
+            while True:
+                data = await protocol.read_message(reader)
+
+                game = self.games.get(game_id)
+                if game is None:
+                    break
+
+                # only this game's clocks are brought up to date, and its
+                # deadline only moves when a move is made
+                async with self.locks[game_id]:
+                    sequence = protocol.get_sequence(game)
+                    if not has_result(game):
+                        game.update_timers()
+                    reply = get_reply(game, p, data)
+
+                    if protocol.get_sequence(game) != sequence:
+                        self.clocks.schedule(game_id, game)
+                        self.clocks_changed.set()
+
+                writer.write(protocol.frame(reply))
+                await writer.drain()
+
+        except (ConnectionError, EOFError, struct.error, ValueError):
+            pass
+
+        finally:
+            self.leave_game(game_id)
+            writer.close()
+
+    async def run_clocks(self):
+        # sleep until the next flag falls or a sooner one is scheduled
+        while True:
+            deadline = self.clocks.get_next_deadline()
+
+            self.clocks_changed.clear()
+            try:
+                await asyncio.wait_for(
+                    self.clocks_changed.wait(),
+                    None if deadline is None else max(0, deadline - time()))
+            except asyncio.TimeoutError:
+                pass
+
+            for game_id in self.clocks.get_due(time()):
+                game = self.games.get(game_id)
+                if game is None or has_result(game):
+                    continue
+
+                async with self.locks[game_id]:
+                    game.update_timers()
+
+                    # woken a touch early by the clock's resolution
+                    if not game.timeout:
+                        self.clocks.schedule(game_id, game)
+
+    async def serve(self, host, port):
+        async_server = await asyncio.start_server(self.handle_client, host,
+                                                  port, backlog=backlog)
+        clock_task = asyncio.create_task(self.run_clocks())
+        print("Waiting for a connection, Server Started")
+
+        try:
+            async with async_server:
+                await async_server.serve_forever()
+        finally:
+            clock_task.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host online games.')
+    parser.add_argument('--host', default=server)
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--threaded', action='store_true',
+                        help='start a thread per connection as before')
+    args = parser.parse_args()
+
+    if args.threaded:
+        run_threaded(args.host, args.port)
+    else:
+        asyncio.run(GameServer().serve(args.host, args.port))
@@ -0,0 +1,308 @@
+import argparse
+import mmap
+import os
+from array import array
+from itertools import product
+
+import engine
+
+
+# the material sets there are tables for, the stronger side's pieces and
+# then the lone king, each with the sets a pawn can promote into, which have
+# to be generated first
+MATERIAL_SETS = {'KQK': (), 'KRK': (), 'KPK': ('KQK', 'KRK'), 'KBNK': ()}
+
+# a table holds one byte per position with the stronger side as white, the
+# positions with white to move and then those with the lone king to move,
+# each numbered by the squares of the pieces in the order of the material
+# set read as a base 64 number, the byte is 0 for a draw or a position that
+# can't happen and otherwise one more than the number of plies to mate
+
+
+def get_pieces(material):
+    return material[:-1].lower() + 'k'
+
+
+def get_index(squares):
+    index = 0
+    for square in squares:
+        index = index * 64 + square
+
+    return index
+
+
+def get_squares(index, n):
+    squares = []
+    for _ in range(n):
+        index, square = divmod(index, 64)
+        squares.append(square)
+
+    return squares[::-1]
+
+
+def get_attacks(piece, square, occupied):
+    # the squares a white piece attacks
+    if piece == 'k':
+        return engine.KING_ATTACKS[square]
+    elif piece == 'q':
+        return engine.get_rook_attacks(square, occupied) | \
+            engine.get_bishop_attacks(square, occupied)
+    elif piece == 'r':
+        return engine.get_rook_attacks(square, occupied)
+    elif piece == 'b':
+        return engine.get_bishop_attacks(square, occupied)
+    elif piece == 'n':
+        return engine.KNIGHT_ATTACKS[square]
+
+    return engine.PAWN_ATTACKS['w'][square]
+
+
+def get_unmoves(piece, square, occupied):
+    # the squares a white piece could have moved to square from
+    if piece != 'p':
+        return get_attacks(piece, square, occupied) & ~occupied
+
+    unmoves = 0
+    if square >> 3 <= 5 and not occupied >> (square + 8) & 1:
+        unmoves |= 1 << (square + 8)
+        if square >> 3 == 4 and not occupied >> (square + 16) & 1:
+            unmoves |= 1 << (square + 16)
+
+    return unmoves
+
+
+def generate(material, directory):
+    pieces = get_pieces(material)
+    n = len(pieces)
+    size = 64 ** n
+
+    values = bytearray(2 * size)
+
+    # positions that are legal with white to move, and for each position
+    # with the lone king to move how many of its moves are yet to be shown
+    # to lose, 255 if it can take a piece and so can never lose
+    legal = bytearray(size)
+    moves_left = bytearray(size)
+
+    # positions by plies to mate, waiting for the positions a move before
+    # them to be found
+    levels = {}
+
+    def set_value(index, plies):
+        values[index] = plies + 1
+        if plies not in levels:
+            levels[plies] = array('L')
+        levels[plies].append(index)
+
+    promotions = [load_table(sub_material, directory)
+                  for sub_material in MATERIAL_SETS[material]]
+
+    for white_squares in product(range(64), repeat=n - 1):
+        if len(set(white_squares)) < n - 1 or \
+                any(piece == 'p' and square >> 3 in (0, 7)
+                    for piece, square in zip(pieces, white_squares)):
+            continue
+
+        white = 0
+        for square in white_squares:
+            white |= 1 << square
+
+        # seen through the lone king, so it can't step back along the line
+        # it is checked on
+        attacks = 0
+        for piece, square in zip(pieces, white_squares):
+            attacks |= get_attacks(piece, square, white)
+
+        white_index = get_index(white_squares) * 64
+
+        for king in range(64):
+            king_bit = 1 << king
+            if white & king_bit or \
+                    engine.KING_ATTACKS[white_squares[0]] & king_bit:
+                continue
+
+            index = white_index + king
+            targets = engine.KING_ATTACKS[king] & ~attacks
+
+            if targets & white:
+                moves_left[index] = 255
+            elif targets:
+                moves_left[index] = targets.bit_count()
+            elif attacks & king_bit:
+                set_value(size + index, 0)
+
+            if attacks & king_bit:
+                continue
+
+            legal[index] = 1
+
+            # a promotion wins as quickly as the position it leads to, under
+            # promotions to the pieces there are no tables for draw
+            for i, (piece, square) in enumerate(zip(pieces, white_squares)):
+                if piece != 'p' or square >> 3 != 1 or \
+                        (white | king_bit) >> (square - 8) & 1:
+                    continue
+
+                promoted = list(white_squares) + [king]
+                promoted[i] = square - 8
+                for table in promotions:
+                    value = table[size + get_index(promoted)]
+                    if value and (not values[index] or
+                                  values[index] > value + 1):
+                        set_value(index, value)
+
+    plies = 0
+    while plies <= max(levels, default=-1):
+        for index in levels.pop(plies, ()):
+            # left behind when a shorter mate was found
+            if values[index] != plies + 1:
+                continue
+
+            squares = get_squares(index % size, n)
+            occupied = 0
+            for square in squares:
+                occupied |= 1 << square
+
+            if index >= size:
+                # every white move to here from a legal position mates one
+                # ply later, if nothing mates sooner
+                for i, piece in enumerate(pieces[:-1]):
+                    unmoves = get_unmoves(piece, squares[i], occupied)
+                    while unmoves:
+                        bit = unmoves & -unmoves
+                        unmoves ^= bit
+
+                        squares[i], square = bit.bit_length() - 1, squares[i]
+                        before = get_index(squares)
+                        squares[i] = square
+
+                        if legal[before] and (not values[before] or
+                                              values[before] > plies + 2):
+                            set_value(before, plies + 1)
+            else:
+                # a lone king position is lost once every move from it is,
+                # and the last of them to be found is the longest
+                unmoves = engine.KING_ATTACKS[squares[-1]] & ~occupied
+                while unmoves:
+                    bit = unmoves & -unmoves
+                    unmoves ^= bit
+
+                    squares[-1], square = bit.bit_length() - 1, squares[-1]
+                    before = get_index(squares)
+                    squares[-1] = square
+
+                    if moves_left[before] in (0, 255):
+                        continue
+
+                    moves_left[before] -= 1
+                    if not moves_left[before]:
+                        set_value(size + before, plies + 1)
+
+        plies += 1
+
+    path = os.path.join(directory, material + '.tb')
+    with open(path, 'wb') as f:
+        f.write(values)
+
+    return path
+
+
+def load_table(material, directory):
+    path = os.path.join(directory, material + '.tb')
+    if not os.path.exists(path):
+        generate(material, directory)
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class Tablebases:
+    def __init__(self, directory):
+        # mapped rather than read, so that every process searching with them
+        # shares the same pages
+        self.tables = {}
+        self.max_pieces = 0
+
+        for material in MATERIAL_SETS:
+            path = os.path.join(directory, material + '.tb')
+            if not os.path.exists(path):
+                continue
+
+            with open(path, 'rb') as f:
+                self.tables[material] = mmap.mmap(f.fileno(), 0,
+                                                  access=mmap.ACCESS_READ)
+            self.max_pieces = max(self.max_pieces, len(material))
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+        self.max_pieces = 0
+
+    def probe(self, game_state):
+        # 1 if the side to move wins, -1 if it loses and 0 for a draw, with
+        # the plies to mate, or None for a position there is no table for
+        if any(game_state.castling.values()):
+            return None
+
+        if len(game_state.black_has) == 1:
+            color, has = 'w', game_state.white_has
+        elif len(game_state.white_has) == 1:
+            color, has = 'b', game_state.black_has
+        else:
+            return None
+
+        if len(has) == 1 or (len(has) == 2 and
+                             ('b' in has or 'n' in has)):
+            return 0, 0
+
+        material = 'K' + ''.join(piece.upper() for piece in 'qrbnp'
+                                 if piece in has) + 'K'
+        if material not in self.tables or len(material) != len(has) + 1:
+            return None
+
+        # the tables have the stronger side as white, for black the board is
+        # flipped top to bottom
+        flip = 0 if color == 'w' else 56
+        squares = [(game_state.bitboards[color + piece].bit_length() - 1) ^
+                   flip for piece in get_pieces(material)[:-1]]
+        enemy_king = 'bk' if color == 'w' else 'wk'
+        squares.append((game_state.bitboards[enemy_king].bit_length() - 1) ^
+                       flip)
+
+        to_move = game_state.white_move == (color == 'w')
+        index = get_index(squares)
+        if not to_move:
+            index += 64 ** len(squares)
+
+        value = self.tables[material][index]
+        if not value:
+            return 0, 0
+
+        return (1 if to_move else -1), value - 1
+
+
+def open_tablebases(directory):
+    if not os.path.isdir(directory):
+        return None
+
+    tablebases = Tablebases(directory)
+    if not tablebases.tables:
+        return None
+
+    return tablebases
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate distance to mate endgame tables.')
+    parser.add_argument('directory')
+    parser.add_argument('material', nargs='*', default=list(MATERIAL_SETS),
+                        choices=list(MATERIAL_SETS))
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+
+    for material in args.material:
+        print('{} written to {}'.format(material,
+                                        generate(material, args.directory)))